@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,12 +83,62 @@ ASGI_APPLICATION = 'backend.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres for production; SQLite (the default) serializes all
+# writes and is only meant for development and tests.
+#
+# DB_POOL_MODE (postgres only):
+#   native     - psycopg connection pool per worker process (default)
+#   pgbouncer  - behind pgbouncer in transaction mode: persistent connections
+#                to pgbouncer, no server-side cursors
+#   persistent - one persistent connection per thread, CONN_MAX_AGE seconds
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'native')
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'maxChat'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL_MODE == 'native':
+        # Pooled connections are returned after each request/call; Django
+        # requires CONN_MAX_AGE=0 with a pool
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 60))
+        if DB_POOL_MODE == 'pgbouncer':
+            DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
+
+# Threads per worker process for ORM calls made by WebSocket consumers
+# (chat.db). Each holds at most one connection, so it defaults to the pool
+# size; leave a few connections spare for HTTP requests on mixed workers.
+# 1 keeps channels' single shared thread, which is all SQLite can use.
+DB_THREAD_POOL_SIZE = int(os.environ.get(
+    'DB_THREAD_POOL_SIZE',
+    DB_POOL_MAX_SIZE if DB_ENGINE == 'postgres' else 1,
+))
 
 
 # Password validation
@@ -108,6 +159,25 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Hasher for new passwords: pbkdf2 (Django's default) or argon2 (needs
+# argon2-cffi). Hashes made by the others still verify and are replaced
+# with the preferred one at the user's next login.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if PASSWORD_HASHER == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+
+# Threads per worker process that hash and verify passwords (chat.passwords).
+# Logins beyond that queue, and get a 503 after PASSWORD_HASH_TIMEOUT seconds
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -155,6 +225,46 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Chat history pagination (ConversationView ?limit=)
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', 50))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_MAX_PAGE_SIZE', 200))
+
+# User directory pagination (ListAllUsers ?limit=)
+USER_DIRECTORY_PAGE_SIZE = int(os.environ.get('USER_DIRECTORY_PAGE_SIZE', 50))
+USER_DIRECTORY_MAX_PAGE_SIZE = int(os.environ.get('USER_DIRECTORY_MAX_PAGE_SIZE', 200))
+
+# Largest group room, counting its creator (GroupListView, GroupMembersView)
+CHAT_GROUP_MAX_MEMBERS = int(os.environ.get('CHAT_GROUP_MAX_MEMBERS', 256))
+
+# Message search (MessageSearchView ?limit=)
+CHAT_SEARCH_PAGE_SIZE = int(os.environ.get('CHAT_SEARCH_PAGE_SIZE', 20))
+CHAT_SEARCH_MAX_PAGE_SIZE = int(os.environ.get('CHAT_SEARCH_MAX_PAGE_SIZE', 100))
+
+# Reconnect catch-up (ChatConsumer.handle_sync): messages per sync_batch
+# frame, and the most sent before the client is told to reload instead
+CHAT_SYNC_BATCH_SIZE = int(os.environ.get('CHAT_SYNC_BATCH_SIZE', 100))
+CHAT_SYNC_MAX_MESSAGES = int(os.environ.get('CHAT_SYNC_MAX_MESSAGES', 1000))
+
+# Frames a socket may have waiting before it is disconnected as a slow
+# consumer (chat.outbound). Typing events are coalesced instead, and
+# dropped rather than counted once the queue is full
+CHAT_OUTBOUND_QUEUE_LIMIT = int(os.environ.get('CHAT_OUTBOUND_QUEUE_LIMIT', 256))
+
+# Group commit for incoming chat messages (chat.batching). Off by default;
+# when on, messages arriving within the window are written in one transaction
+CHAT_GROUP_COMMIT_ENABLED = os.environ.get('CHAT_GROUP_COMMIT_ENABLED', 'False') == 'True'
+CHAT_GROUP_COMMIT_WINDOW_MS = float(os.environ.get('CHAT_GROUP_COMMIT_WINDOW_MS', 5))
+CHAT_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('CHAT_GROUP_COMMIT_MAX_BATCH', 50))
+
+# Typing indicators (chat.typing_indicators): repeats of the same state
+# within the window are dropped; "typing" auto-stops after the timeout
+TYPING_THROTTLE_WINDOW_SECONDS = float(os.environ.get('TYPING_THROTTLE_WINDOW_SECONDS', 2.5))
+TYPING_AUTO_STOP_SECONDS = float(os.environ.get('TYPING_AUTO_STOP_SECONDS', 5))
+
+# WebSocket handshake cache of validated access tokens (chat.middleware)
+WS_AUTH_CACHE_SIZE = int(os.environ.get('WS_AUTH_CACHE_SIZE', 1024))
+WS_AUTH_CACHE_TTL = int(os.environ.get('WS_AUTH_CACHE_TTL', 300))
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # React default port
     "http://127.0.0.1:3000",
@@ -182,16 +292,66 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')  
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
 
+# Shared by every server process, so user_<id> groups work across workers
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
+        },
+    },
+}
 
-            "hosts": [(REDIS_HOST, 6379)],
+# Presence (chat.presence): connection counts live in Redis, UserStatus is
+# written in batches. Use chat.presence.LocalPresenceStore without Redis.
+PRESENCE_BACKEND = os.environ.get('PRESENCE_BACKEND', 'chat.presence.RedisPresenceStore')
+PRESENCE_OFFLINE_GRACE_SECONDS = float(os.environ.get('PRESENCE_OFFLINE_GRACE_SECONDS', 5))
+PRESENCE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('PRESENCE_FLUSH_INTERVAL_SECONDS', 10))
+PRESENCE_OPTIONS = {
+    'host': REDIS_HOST,
+    'port': REDIS_PORT,
+    # Instance hashes outlive a few missed heartbeats (one per flush)
+    'ttl': int(PRESENCE_FLUSH_INTERVAL_SECONDS * 6),
+}
 
-            "hosts": [("redis", 6379)],
+# Revoked JWTs (chat.revocation), shared so a logout reaches every worker
+TOKEN_REVOCATION_BACKEND = os.environ.get('TOKEN_REVOCATION_BACKEND', 'chat.revocation.RedisRevocationStore')
+TOKEN_REVOCATION_OPTIONS = {
+    'host': REDIS_HOST,
+    'port': REDIS_PORT,
+}
 
+# Logging for the chat app. Per-frame WebSocket logs are sampled at
+# CHAT_LOG_SAMPLE_RATE; anything containing message content is logged at
+# CHAT_MESSAGE_LOG_LEVEL (chat.logutils.HotPathLogger)
+CHAT_LOG_LEVEL = os.environ.get('CHAT_LOG_LEVEL', 'WARNING')
+CHAT_MESSAGE_LOG_LEVEL = os.environ.get('CHAT_MESSAGE_LOG_LEVEL', 'DEBUG')
+CHAT_LOG_SAMPLE_RATE = float(os.environ.get('CHAT_LOG_SAMPLE_RATE', 0.01))
+
+# JSON codec for WebSocket frames (chat.codec): auto | orjson | json
+CHAT_JSON_CODEC = os.environ.get('CHAT_JSON_CODEC', 'auto')
+
+# Metrics (chat.metrics) served at /metrics/, summed over the gunicorn
+# workers. METRICS_ENABLED=False hides the endpoint. Set METRICS_TOKEN to
+# require "Authorization: Bearer <token>"
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['console'],
+            'level': CHAT_LOG_LEVEL,
+            'propagate': False,
         },
     },
 }
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from chat.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('chat/',include('chat.urls'))
+    path('chat/',include('chat.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
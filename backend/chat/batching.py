@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+from django.db import transaction
+
+from chat.db import database_sync_to_async
+from chat.models import Chat, InboxState
+
+logger = logging.getLogger(__name__)
+
+
+def group_commit_enabled():
+    return getattr(settings, 'CHAT_GROUP_COMMIT_ENABLED', False)
+
+
+def write_messages(messages):
+    """Insert a batch of unsaved Chat rows and update the inbox in one transaction"""
+    with transaction.atomic():
+        Chat.assign_seqs(messages)
+        messages = Chat.objects.bulk_create(messages)
+        InboxState.record_messages(messages)
+    return messages
+
+
+class MessageBatchWriter:
+    """Group-commit writer for chat messages.
+
+    Messages submitted within ``window`` seconds of the first pending one,
+    or until ``max_batch`` are pending, are written with one bulk_create in
+    one transaction. Each submitter gets its own saved row (with id) back
+    once the batch has committed. If the batch fails, its messages are
+    retried one per transaction, so only the submitter of a bad row gets
+    the exception.
+    """
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_handle = None
+        self.flush_tasks = set()
+
+    async def submit(self, message):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((message, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.write_batch(batch))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def write_batch(self, batch):
+        try:
+            saved = await database_sync_to_async(write_messages)([message for message, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error("Writing message failed: %s", e)
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            logger.warning("Group commit of %s messages failed, writing them one by one: %s", len(batch), e)
+            for message, future in batch:
+                # Undo what the failed attempt assigned
+                message.pk = message.seq = None
+                await self.write_batch([(message, future)])
+            return
+
+        for (_, future), message in zip(batch, saved):
+            if not future.done():
+                future.set_result(message)
+
+
+# One writer per event loop; the pending batch and its timer belong to that loop
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_batch_writer():
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageBatchWriter(
+            window=getattr(settings, 'CHAT_GROUP_COMMIT_WINDOW_MS', 5) / 1000,
+            max_batch=getattr(settings, 'CHAT_GROUP_COMMIT_MAX_BATCH', 50),
+        )
+    return writer
@@ -0,0 +1,131 @@
+"""
+Encoding of WebSocket frames.
+
+JSON is the default wire format. CHAT_JSON_CODEC picks the implementation:
+"orjson" (several times faster than the stdlib), "json", or "auto" (the
+default), which uses orjson when it is installed. Both produce compact JSON
+as str, since WebSocket text frames carry str, and both raise
+json.JSONDecodeError (orjson's subclasses it) on bad input.
+
+A client may instead offer the "chat.msgpack" subprotocol and get the same
+events as MessagePack in binary frames. Every codec raises a ValueError on
+bad input.
+"""
+import json
+import logging
+
+import msgpack
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StdlibCodec:
+    name = 'json'
+    label = 'JSON'
+    binary = False
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = 'orjson'
+    label = 'JSON'
+    binary = False
+
+    @staticmethod
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    label = 'MessagePack'
+    binary = True
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj)
+
+    @staticmethod
+    def loads(data):
+        # Integer map keys are what msgpack clients send for sync cursors
+        return msgpack.unpackb(data, strict_map_key=False)
+
+
+JSON_SUBPROTOCOL = 'chat.json'
+MSGPACK_SUBPROTOCOL = 'chat.msgpack'
+
+_codecs = {}
+
+
+def get_codec():
+    choice = getattr(settings, 'CHAT_JSON_CODEC', 'auto')
+    codec = _codecs.get(choice)
+    if codec is None:
+        if choice == 'orjson' or (choice == 'auto' and orjson is not None):
+            if orjson is None:
+                logger.warning("CHAT_JSON_CODEC=orjson but orjson is not installed, using json")
+                codec = StdlibCodec
+            else:
+                codec = OrjsonCodec
+        else:
+            codec = StdlibCodec
+        _codecs[choice] = codec
+    return codec
+
+
+def dumps(obj):
+    return get_codec().dumps(obj)
+
+
+def loads(data):
+    return get_codec().loads(data)
+
+
+def negotiate(offered):
+    """(subprotocol to accept, codec) for the client's Sec-WebSocket-Protocol list.
+
+    The client's first supported choice wins. Clients that offer nothing we
+    know get JSON and no subprotocol, as before.
+    """
+    for subprotocol in offered:
+        if subprotocol == MSGPACK_SUBPROTOCOL:
+            return subprotocol, MsgpackCodec
+        if subprotocol == JSON_SUBPROTOCOL:
+            return subprotocol, get_codec()
+    return None, get_codec()
+
+
+def encode_event(handler, payload):
+    """Channel-layer event carrying ``payload`` encoded once as JSON.
+
+    ``handler`` is the consumer method that forwards it. JSON sockets send
+    the text as is. Only the sockets that negotiated chat.msgpack convert it
+    (event_msgpack), so the sender and the channel layer never pay for a
+    second encoding most recipients don't use.
+    """
+    return {
+        'type': handler,
+        'text': dumps(payload),
+    }
+
+
+def event_msgpack(event):
+    """The MessagePack frame for an encode_event() event"""
+    return MsgpackCodec.dumps(loads(event['text']))
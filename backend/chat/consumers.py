@@ -1,266 +1,628 @@
-import json
+import asyncio
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.utils import timezone
-from chat.models import UserStatus, Chat, ChatRoom
+from django.db import transaction
+from django.db.models import Min, Q
+from chat.models import Chat, ChatRoom, InboxState
+from chat.db import database_sync_to_async
+from chat.batching import get_batch_writer, group_commit_enabled
+from chat.presence import get_presence
+from chat.logutils import HotPathLogger
+from chat.typing_indicators import get_typing_throttle
+from chat import codec
+from chat.groups import room_group
+from chat.metrics import ws_connections, ws_connects, ws_event_seconds, ws_group_send_seconds, ws_slow_consumer_evictions
+from chat.outbound import OutboundQueue
 from django.contrib.auth.models import User
 import logging
 
 logger = logging.getLogger(__name__)
+hot_log = HotPathLogger(logger)
+
+# Upper bound on receivers remembered per connection by resolve_room
+ROOM_CACHE_SIZE = 256
+
+# Inbound frame types with a handler; anything else is timed as "unknown"
+EVENT_TYPES = ('chat_message', 'typing', 'read_receipt', 'read_up_to', 'sync')
+
+MAX_CONTENT_LENGTH = Chat._meta.get_field('content').max_length
+
+# Upper bound on rooms named in one sync request
+SYNC_MAX_CURSORS = 1000
+
+# Close code for a client evicted as a slow consumer, and how long its
+# resume hint may take to go out before the socket is closed regardless
+SLOW_CONSUMER_CLOSE_CODE = 4008
+RESUME_HINT_TIMEOUT = 1
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         
         # checking the user is authenticated or not
-        logger.info(f"🔌 WebSocket connect attempt - User type: {type(self.scope['user'])}")
-        logger.info(f"🔌 User object: {self.scope['user']}")
-        
         if isinstance(self.scope['user'], AnonymousUser):
-            logger.error("❌ WebSocket REJECTED - User is AnonymousUser (not authenticated)")
+            logger.warning("❌ WebSocket REJECTED - User is AnonymousUser (not authenticated)")
+            ws_connects.labels('rejected').inc()
             await self.close()
             return
         
         self.user = self.scope['user']
         self.group_name = f'user_{self.user.id}'
-        
-        logger.info(f"✓ User authenticated: {self.user.username} (ID: {self.user.id})")
+        # receiver_id -> (chatroom_id, receiver_username), see resolve_room
+        self.room_cache = {}
+        # Ids of the group rooms the user is in, kept current by room_joined/
+        # room_left events; sends to a group room are checked against it
+        self.group_rooms = set()
         
         try:
             await self.channel_layer.group_add(
                 self.group_name,
                 self.channel_name
             )
+            self.group_rooms = await self.load_group_rooms()
+            for room_id in self.group_rooms:
+                await self.channel_layer.group_add(room_group(room_id), self.channel_name)
             
-            await self.accept()
-            logger.info(f"✓ WebSocket ACCEPTED for user: {self.user.username}")
+            # JSON unless the client offers chat.msgpack
+            subprotocol, self.codec = codec.negotiate(self.scope.get('subprotocols', []))
+            await self.accept(subprotocol=subprotocol)
+            self.outbound = OutboundQueue(self.send_frame, getattr(settings, 'CHAT_OUTBOUND_QUEUE_LIMIT', 256))
+            self.outbound.start()
+            self.accepted = True
+            ws_connects.labels('accepted').inc()
+            ws_connections.inc()
+            logger.info("✓ WebSocket ACCEPTED for user_id=%s", self.user.id)
             
-            await self.update_online_status(True)
+            await self.update_presence(True)
             
             # Send connection confirmation
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'connection',
                 'status': 'connected',
                 'user_id': self.user.id
-            }))
+            })
             
         except Exception as e:
-            logger.error(f"❌ Error during WebSocket connect: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("❌ Error during WebSocket connect: %s", e)
             await self.close()
             
     async def disconnect(self, close_code):
-        logger.info(f'User {self.user} is trying to logout')
+        logger.info("WebSocket disconnect user=%s code=%s", getattr(self, 'user', None), close_code)
+        if getattr(self, 'accepted', False):
+            ws_connections.dec()
+            self.accepted = False
+        if hasattr(self, 'outbound'):
+            self.outbound.close()
         if hasattr(self, "group_name"):
-            await self.update_online_status(False)
+            await self.update_presence(False)
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
+            for room_id in self.group_rooms:
+                await self.channel_layer.group_discard(room_group(room_id), self.channel_name)
 
-    async def receive(self, text_data):
-        logger.info(f'User received message from the frontend: {text_data}')
+    async def receive(self, text_data=None, bytes_data=None):
+        hot_log.body("ws receive user_id=%s frame=%r", self.user.id, text_data if bytes_data is None else bytes_data)
+        # Binary frames use the negotiated codec; text frames are always JSON
+        decoder = self.codec if bytes_data is not None and self.codec.binary else codec.get_codec()
+        try:
+            data = decoder.loads(text_data if bytes_data is None else bytes_data)
+        except ValueError:
+            await self.send_payload({
+                'type': 'error',
+                'error': f'Invalid {decoder.label} format'
+            })
+            return
+        
         try:
-            data = json.loads(text_data)
             event_type = data.get('type')
+            hot_log.sampled("ws receive user_id=%s type=%s", self.user.id, event_type)
             
-            if event_type == "chat_message":
-                await self.handle_chat_message(data)
-            elif event_type == 'typing':
-                await self.handle_typing_indicator(data)
-            elif event_type == 'read_receipt':
-                await self.handle_read_receipt(data)
-            else:
-                logger.warning(f"Unknown chat message type: {event_type}")
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'error': 'Invalid JSON format'
-            }))
+            with ws_event_seconds.labels(event_type if event_type in EVENT_TYPES else 'unknown').time():
+                if event_type == "chat_message":
+                    await self.handle_chat_message(data)
+                elif event_type == 'typing':
+                    await self.handle_typing_indicator(data)
+                elif event_type == 'read_receipt':
+                    await self.handle_read_receipt(data)
+                elif event_type == 'read_up_to':
+                    await self.handle_read_up_to(data)
+                elif event_type == 'sync':
+                    await self.handle_sync(data)
+                else:
+                    logger.warning("Unknown chat message type: %s", event_type)
         except Exception as e:
-            logger.error(f"Error handling chat message: {str(e)}")
-            await self.send(text_data=json.dumps({
+            logger.error("Error handling chat message: %s", e)
+            await self.send_payload({
                 'type': 'error',
                 'error': 'Server error'
-            }))
+            })
 
     async def handle_chat_message(self, data):
+        content = data.get('content')
+        if isinstance(content, str) and len(content) > MAX_CONTENT_LENGTH:
+            # Rejected up front: in a group commit one oversized row would fail the whole batch
+            await self.send_payload({
+                'type': 'error',
+                'error': f'Message is longer than {MAX_CONTENT_LENGTH} characters'
+            })
+            return
+        
+        if data.get('chatroom_id') is not None:
+            await self.handle_group_message(data)
+            return
+        
         receiver_id = data.get('receiver_id')
         content = data.get('content')
         
         if not content or not receiver_id:
-            logger.error("DEBUG: Missing required fields")
-            await self.send(text_data=json.dumps({
+            logger.warning("chat_message missing content or receiver_id user_id=%s", self.user.id)
+            await self.send_payload({
                 'type': 'error',
                 'error': 'No proper content or receiver_id'
-            }))
+            })
             return
         
         message = await self.create_message(data)
         if not message:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'error': 'Failed to create message'
-            }))
+            })
             return
         
         # Send to receiver
-        await self.channel_layer.group_send(
-            f"user_{receiver_id}",
-            {
-                'type': 'chat_message_handler',
-                'message': message,
-                'sender_id': self.user.id,
-                'sender_username': self.user.username
-            }
-        )
+        event = codec.encode_event('chat_message_handler', {
+            'type': 'chat_message',
+            'message': message,
+            'sender_id': self.user.id,
+            'sender_username': self.user.username
+        })
+        event['message_id'] = message['id']
+        event['chatroom_id'] = message['chatroom_id']
+        event['seq'] = message['seq']
+        await self.group_send(f"user_{receiver_id}", event)
         
         # Send confirmation back to sender
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'message_sent',
             'message': message
-        }))
+        }, message_id=message['id'], cursors={message['chatroom_id']: message['seq']})
 
     async def handle_typing_indicator(self, data):
         try:
-            receiver_id = data.get('receiver_id')
-            is_typing = data.get('is_typing', False)
+            is_typing = bool(data.get('is_typing', False))
+            sender_id = self.user.id
+            group_send = self.group_send
+            payload = {
+                'type': 'typing_indicator',
+                'sender_id': sender_id,
+                'sender_username': self.user.username,
+            }
+            exclude = None
+            if data.get('chatroom_id') is not None:
+                chatroom_id = self.group_room_id(data)
+                if chatroom_id is None:
+                    await self.send_payload({
+                        'type': 'error',
+                        'error': 'Not a member of that chatroom'
+                    })
+                    return
+                target = room_group(chatroom_id)
+                payload['chatroom_id'] = chatroom_id
+                exclude = self.channel_name
+            else:
+                try:
+                    target = f"user_{int(data.get('receiver_id'))}"
+                except (TypeError, ValueError):
+                    await self.send_payload({
+                        'type': 'error',
+                        'error': 'typing needs a receiver_id or a chatroom_id'
+                    })
+                    return
             
-            await self.channel_layer.group_send(
-                f"user_{receiver_id}",
-                {
-                    'type': 'typing_indicator_handler',
-                    'is_typing': is_typing,
-                    'sender_id': self.user.id,
-                    'sender_username': self.user.username,
-                }
-            )
+            async def forward(is_typing):
+                event = codec.encode_event('typing_indicator_handler', {**payload, 'is_typing': is_typing})
+                # Only the newest state per sender and target waits in an outbound queue
+                event['coalesce'] = f'typing:{sender_id}:{target}'
+                if exclude:
+                    event['exclude'] = exclude
+                await group_send(target, event)
+            
+            # Repeats are dropped and a stalled "typing" is stopped automatically
+            await get_typing_throttle().submit(sender_id, target, is_typing, forward)
         except Exception as e:
-            logger.error(f"Error handling typing indicator: {str(e)}")
+            logger.error("Error handling typing indicator: %s", e)
 
     async def handle_read_receipt(self, data):
         message_id = data.get('message_id')
         if not message_id:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'error': 'message_id is required'
-            }))
+            })
             return
         
         # Get message details before marking as read
         message_info = await self.get_message_info(message_id)
         if not message_info:
-            logger.error(f"Message {message_id} not found")
+            logger.warning("Message %s not found", message_id)
+            return
+        
+        if message_info['receiver_id'] is None:
+            # Group messages have no per-message read flag
+            await self.send_payload({
+                'type': 'error',
+                'error': 'read_receipt is for direct messages; use read_up_to in group rooms'
+            })
             return
         
         # Only allow users to mark messages sent TO them as read
         if message_info['receiver_id'] != self.user.id:
-            logger.error(f"User {self.user.id} cannot mark message {message_id} as read - not the receiver")
+            logger.warning("User %s cannot mark message %s as read - not the receiver", self.user.id, message_id)
             return
         
         # Mark the message as read
         success = await self.mark_message_as_read(message_id)
         if not success:
-            logger.error(f"Failed to mark message {message_id} as read")
+            logger.error("Failed to mark message %s as read", message_id)
             return
         
-        logger.info(f"✓ Message {message_id} marked as read by user {self.user.id}")
-        
         # Send read receipt to the original sender
-        await self.channel_layer.group_send(
+        await self.group_send(
             f"user_{message_info['sender_id']}",
-            {
-                'type': 'read_receipt_handler',
+            codec.encode_event('read_receipt_handler', {
+                'type': 'read_receipt',
                 'message_id': message_id,
                 'read_by_id': self.user.id,
                 'read_by_username': self.user.username
-            }
+            })
         )
+
+
+    async def handle_read_up_to(self, data):
+        """Mark every message received in the room up to message_id as read"""
+        message_id = data.get('message_id')
+        if not message_id:
+            await self.send_payload({
+                'type': 'error',
+                'error': 'message_id is required'
+            })
+            return
+        
+        result = await self.mark_read_up_to(message_id)
+        if not result or not result['count']:
+            return
         
-        logger.info(f"✓ Read receipt sent to user {message_info['sender_id']} for message {message_id}")
+        # One coalesced receipt instead of one per message
+        event = codec.encode_event('read_up_to_handler', {
+            'type': 'read_up_to',
+            'chatroom_id': result['chatroom_id'],
+            'message_id': message_id,
+            'count': result['count'],
+            'read_by_id': self.user.id,
+            'read_by_username': self.user.username
+        })
+        if result['is_group']:
+            event['exclude'] = self.channel_name
+            await self.group_send(room_group(result['chatroom_id']), event)
+        else:
+            await self.group_send(f"user_{result['sender_id']}", event)
 
-    @database_sync_to_async
-    def update_online_status(self, is_online):
+    async def handle_group_message(self, data):
+        """A message to a group room: stored once, published once to room_<id>"""
+        content = data.get('content')
+        chatroom_id = self.group_room_id(data)
+        if not content or chatroom_id is None:
+            logger.warning("group chat_message without content or membership user_id=%s", self.user.id)
+            await self.send_payload({
+                'type': 'error',
+                'error': 'No proper content or chatroom_id'
+            })
+            return
+        
+        message = await self.create_group_message(chatroom_id, content)
+        if not message:
+            await self.send_payload({
+                'type': 'error',
+                'error': 'Failed to create message'
+            })
+            return
+        
+        event = codec.encode_event('chat_message_handler', {
+            'type': 'chat_message',
+            'message': message,
+            'sender_id': self.user.id,
+            'sender_username': self.user.username
+        })
+        event['message_id'] = message['id']
+        event['chatroom_id'] = message['chatroom_id']
+        event['seq'] = message['seq']
+        # This socket gets message_sent below instead
+        event['exclude'] = self.channel_name
+        await self.group_send(room_group(chatroom_id), event)
+        
+        await self.send_payload({
+            'type': 'message_sent',
+            'message': message
+        }, message_id=message['id'], cursors={message['chatroom_id']: message['seq']})
+
+    async def handle_sync(self, data):
+        """Stream the messages a reconnecting client missed, room by room.
+        
+        ``cursors`` maps each room the client knows to the newest seq it has
+        there. A room's seqs commit in order (ChatRoom.allocate_seqs), so
+        "seq > cursor" can't skip a message that was still being written.
+        Message ids carry no such guarantee across rooms. Rooms missing from
+        ``cursors`` are found through ``after_id``, the newest message id the
+        client has seen. Only the user's rooms are read, each as a range on
+        the (chatroom, seq) index, up to the last_seq it had when sync began;
+        anything newer arrives live.
+        sync_complete returns the advanced cursors, and has truncated=true
+        when more than CHAT_SYNC_MAX_MESSAGES were missed and the client
+        should reload histories instead.
+        """
+        try:
+            after_id = data.get('after_id')
+            after_id = None if after_id is None else int(after_id)
+            cursors = {int(room_id): int(seq) for room_id, seq in (data.get('cursors') or {}).items()}
+        except (AttributeError, TypeError, ValueError):
+            await self.send_payload({
+                'type': 'error',
+                'error': 'cursors must map room ids to seqs and after_id must be an integer'
+            })
+            return
+        if len(cursors) > SYNC_MAX_CURSORS:
+            await self.send_payload({
+                'type': 'error',
+                'error': f'At most {SYNC_MAX_CURSORS} cursors per sync'
+            })
+            return
+        
+        batch_size = getattr(settings, 'CHAT_SYNC_BATCH_SIZE', 100)
+        remaining = getattr(settings, 'CHAT_SYNC_MAX_MESSAGES', 1000)
+        last_id = after_id or 0
+        pending = await self.plan_sync(cursors, after_id)
+        while pending and remaining > 0:
+            limit = min(batch_size, remaining)
+            messages = await self.fetch_missed(pending, limit)
+            for message in messages:
+                room_id = message['chatroom_id']
+                cursors[room_id] = message['seq']
+                pending[room_id] = (message['seq'], pending[room_id][1])
+            if len(messages) < limit:
+                # Every pending room was read to its end
+                pending = {}
+            else:
+                pending = {room_id: seqs for room_id, seqs in pending.items() if seqs[0] < seqs[1]}
+            if not messages:
+                break
+            last_id = max(last_id, max(message['id'] for message in messages))
+            remaining -= len(messages)
+            await self.send_payload({
+                'type': 'sync_batch',
+                'messages': messages,
+                'has_more': bool(pending)
+            }, message_id=last_id, cursors={message['chatroom_id']: message['seq'] for message in messages})
+        
+        await self.send_payload({
+            'type': 'sync_complete',
+            'cursors': {str(room_id): seq for room_id, seq in cursors.items()},
+            'last_id': last_id,
+            'truncated': bool(pending)
+        }, message_id=last_id)
+
+    async def group_send(self, group, event):
+        with ws_group_send_seconds.labels(event['type']).time():
+            await self.channel_layer.group_send(group, event)
+
+    async def update_presence(self, is_online):
+        # Reference-counted in the presence store; UserStatus is written in batches
         try:
-            user_status, created = UserStatus.objects.get_or_create(user=self.user)
-            user_status.is_online = is_online
             if is_online:
-                user_status.last_seen = None
+                await get_presence().user_connected(self.user.id)
             else:
-                user_status.last_seen = timezone.now()
-            user_status.save()
-            logger.info(f"Updated user status: {self.user.username} - Online: {is_online}")
+                await get_presence().user_disconnected(self.user.id)
         except Exception as e:
-            logger.error(f"Error updating online status: {e}")
-            try:
-                UserStatus.objects.update_or_create(
-                    user=self.user,
-                    defaults={
-                        'is_online': is_online,
-                        'last_seen': timezone.now() if not is_online else None
-                    }
-                )
-            except Exception as e2:
-                logger.error(f"Fallback status update failed: {e2}")
+            logger.error("Error updating online status: %s", e)
+
+    def resolve_room(self, receiver_id):
+        """Look up the receiver and the direct room once per connection.
+        
+        Returns (chatroom_id, receiver_username) and caches it so later
+        sends to the same receiver skip both queries.
+        """
+        room = self.room_cache.get(receiver_id)
+        if room is not None:
+            return room
+        
+        try:
+            receiver = User.objects.only('id', 'username').get(id=receiver_id)
+        except User.DoesNotExist:
+            logger.warning("Recipient user %s not found", receiver_id)
+            return None
+        
+        chat_room = ChatRoom.get_or_create_room(self.user, receiver)
+        logger.debug("Resolved chat room %s for receiver %s", chat_room.id, receiver_id)
+        
+        if len(self.room_cache) >= ROOM_CACHE_SIZE:
+            self.room_cache.pop(next(iter(self.room_cache)))
+        room = self.room_cache[receiver_id] = (chat_room.id, receiver.username)
+        return room
+
+    def group_room_id(self, data):
+        """The frame's chatroom_id if it is a group room this user is in, else None"""
+        try:
+            chatroom_id = int(data.get('chatroom_id'))
+        except (TypeError, ValueError):
+            return None
+        return chatroom_id if chatroom_id in self.group_rooms else None
 
     @database_sync_to_async
-    def create_message(self, data):
+    def load_group_rooms(self):
+        return set(
+            ChatRoom.objects.filter(participants=self.user, is_group=True).values_list('id', flat=True)
+        )
+
+    def message_payload(self, message, receiver_id):
+        # Built from the connection's user and the cached room, no re-fetch
+        return {
+            'id': message.id,
+            'chatroom_id': message.chatroom_id,
+            'seq': message.seq,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'sender_id': self.user.id,
+            'sender_username': self.user.username,
+            'receiver_id': receiver_id,
+            'is_read': message.is_read,
+        }
+
+    async def create_message(self, data):
+        if group_commit_enabled():
+            return await self.create_message_batched(data)
+        return await self.save_message(data)
+
+    @database_sync_to_async
+    def save_message(self, data):
         try:
             content = data.get('content')
-            receiver_id = data.get('receiver_id')
+            receiver_id = int(data.get('receiver_id'))
             sender = self.user
             
             if not sender:
                 logger.error("Sender is not present")
                 return None
             
-            try:
-                receiver = User.objects.get(id=receiver_id)
-            except User.DoesNotExist:
-                logger.error(f"Recipient user {receiver_id} not found")
+            room = self.resolve_room(receiver_id)
+            if room is None:
                 return None
+            chatroom_id, receiver_username = room
             
-            chat_room = ChatRoom.get_or_create_room(sender, receiver)
-            logger.info(f"DEBUG: Chat room ID: {chat_room.id}")
-            
-            message = Chat.objects.create(
-                chatroom=chat_room,
-                sender=sender,
-                receiver=receiver,
-                content=content,
-            )
+            with transaction.atomic():
+                message = Chat.objects.create(
+                    chatroom_id=chatroom_id,
+                    sender_id=sender.id,
+                    receiver_id=receiver_id,
+                    content=content,
+                )
+                InboxState.record_message(message)
             
-            result = {
-                'id': message.id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'sender_id': message.sender.id,
-                'sender_username': message.sender.username,
-                'receiver_id': message.receiver.id,
-                'is_read': message.is_read,
-            }
-            logger.info(f"DEBUG: Returning message data: {result}")
+            result = self.message_payload(message, receiver_id)
+            hot_log.body("Saved chat message %s", result)
             return result
         except Exception as e:
-            logger.error(f"Error saving chat message: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error saving chat message: %s", e)
+            return None
+
+    async def create_message_batched(self, data):
+        """Group-commit variant of save_message, see chat.batching"""
+        try:
+            receiver_id = int(data.get('receiver_id'))
+            room = self.room_cache.get(receiver_id)
+            if room is None:
+                room = await database_sync_to_async(self.resolve_room)(receiver_id)
+                if room is None:
+                    return None
+            chatroom_id, receiver_username = room
+            
+            message = await get_batch_writer().submit(Chat(
+                chatroom_id=chatroom_id,
+                sender_id=self.user.id,
+                receiver_id=receiver_id,
+                content=data.get('content'),
+            ))
+            return self.message_payload(message, receiver_id)
+        except Exception as e:
+            logger.error("Error saving chat message: %s", e)
+            return None
+
+    async def create_group_message(self, chatroom_id, content):
+        message = Chat(chatroom_id=chatroom_id, sender_id=self.user.id, content=content)
+        try:
+            if group_commit_enabled():
+                message = await get_batch_writer().submit(message)
+            else:
+                await self.save_group_message(message)
+        except Exception as e:
+            logger.error("Error saving group message: %s", e)
             return None
+        return self.message_payload(message, None)
+
+    @database_sync_to_async
+    def save_group_message(self, message):
+        with transaction.atomic():
+            message.save()
+            InboxState.record_message(message)
+
+    @database_sync_to_async
+    def plan_sync(self, cursors, after_id):
+        """{room_id: (cursor, last_seq)} for the user's rooms with missed messages.
+        
+        ChatRoom.last_seq says which rooms have anything past their cursor,
+        so rooms with nothing new cost no message query. Rooms the client has
+        no cursor for start at their first message past ``after_id``.
+        """
+        rooms = dict(ChatRoom.objects.filter(participants=self.user).order_by().values_list('id', 'last_seq'))
+        pending = {}
+        uncursored = []
+        for room_id, last_seq in rooms.items():
+            cursor = cursors.get(room_id)
+            if cursor is None:
+                if after_id is not None and last_seq:
+                    uncursored.append(room_id)
+            elif cursor < last_seq:
+                pending[room_id] = (cursor, last_seq)
+        if uncursored:
+            first_seqs = (
+                Chat.objects.filter(chatroom_id__in=uncursored, id__gt=after_id)
+                .values('chatroom_id')
+                .annotate(first_seq=Min('seq'))
+                .order_by()
+            )
+            for row in first_seqs:
+                pending[row['chatroom_id']] = (row['first_seq'] - 1, rooms[row['chatroom_id']])
+        return pending
+
+    @database_sync_to_async
+    def fetch_missed(self, pending, limit):
+        """Up to ``limit`` messages from ``pending`` (see plan_sync) in (chatroom, seq) order"""
+        rows = []
+        for room_id, (cursor, last_seq) in sorted(pending.items()):
+            # One range scan on (chatroom, seq) per room, until the batch is full
+            rows.extend(
+                Chat.objects.filter(chatroom_id=room_id, seq__gt=cursor, seq__lte=last_seq)
+                .select_related('sender')
+                .only('id', 'chatroom_id', 'seq', 'content', 'timestamp', 'is_read', 'receiver_id', 'sender__username')
+                .order_by('seq')[:limit - len(rows)]
+            )
+            if len(rows) >= limit:
+                break
+        return [{
+            'id': message.id,
+            'chatroom_id': message.chatroom_id,
+            'seq': message.seq,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'sender_id': message.sender_id,
+            'sender_username': message.sender.username,
+            'receiver_id': message.receiver_id,
+            'is_read': message.is_read,
+        } for message in rows]
 
     @database_sync_to_async
     def get_message_info(self, message_id):
         """Get complete message information"""
         try:
-            message = Chat.objects.get(id=message_id)
+            message = Chat.objects.only('sender_id', 'receiver_id', 'is_read').get(id=message_id)
             return {
-                'sender_id': message.sender.id,
-                'sender_username': message.sender.username,
-                'receiver_id': message.receiver.id,
-                'receiver_username': message.receiver.username,
+                'sender_id': message.sender_id,
+                'receiver_id': message.receiver_id,
                 'is_read': message.is_read
             }
-        except Chat.DoesNotExist:
+        except (Chat.DoesNotExist, ValueError):
             return None
 
     @database_sync_to_async
@@ -268,47 +630,139 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             message = Chat.objects.get(id=message_id)
             # Verify the current user is the receiver
-            if message.receiver.id != self.user.id:
-                logger.error(f"User {self.user.id} is not the receiver of message {message_id}")
+            if message.receiver_id != self.user.id:
+                logger.warning("User %s is not the receiver of message %s", self.user.id, message_id)
                 return False
             
             # Only mark as read if not already read
             if not message.is_read:
-                message.is_read = True
-                message.save()
-                logger.info(f"Message {message_id} marked as read")
+                with transaction.atomic():
+                    message.is_read = True
+                    message.save()
+                    InboxState.record_read(message.chatroom_id, self.user.id)
+                logger.debug("Message %s marked as read", message_id)
             else:
-                logger.info(f"Message {message_id} already marked as read")
+                logger.debug("Message %s already marked as read", message_id)
             
             return True
         except Chat.DoesNotExist:
-            logger.error(f"Message {message_id} not found")
+            logger.warning("Message %s not found", message_id)
             return False
         except Exception as e:
-            logger.error(f"Error marking message as read: {e}")
+            logger.error("Error marking message as read: %s", e)
             return False
 
+    @database_sync_to_async
+    def mark_read_up_to(self, message_id):
+        try:
+            # Group messages only through current membership: a user who left
+            # still matches their own messages there through sender_id
+            target = Chat.objects.only('id', 'chatroom_id', 'seq', 'sender_id', 'receiver_id').get(
+                Q(receiver_id=self.user.id)
+                | Q(sender_id=self.user.id, receiver_id__isnull=False)
+                | Q(chatroom_id__in=list(self.group_rooms)),
+                id=message_id,
+            )
+        except (Chat.DoesNotExist, ValueError):
+            logger.warning("Message %s not found for user %s", message_id, self.user.id)
+            return None
+        
+        if target.receiver_id is None:
+            # Group room: read state is the user's last_read_seq, not is_read
+            return {
+                'chatroom_id': target.chatroom_id,
+                'sender_id': target.sender_id,
+                'count': InboxState.record_group_read(target.chatroom_id, self.user.id, target.seq),
+                'is_group': True,
+            }
+        
+        with transaction.atomic():
+            count = Chat.objects.filter(
+                chatroom_id=target.chatroom_id,
+                receiver_id=self.user.id,
+                is_read=False,
+                seq__lte=target.seq,
+            ).update(is_read=True)
+            if count:
+                InboxState.record_read(target.chatroom_id, self.user.id, count)
+        
+        return {
+            'chatroom_id': target.chatroom_id,
+            'sender_id': target.sender_id if target.receiver_id == self.user.id else target.receiver_id,
+            'count': count,
+            'is_group': False,
+        }
+
+    def encode_frame(self, payload):
+        """send() arguments for one event in the connection's negotiated format"""
+        if self.codec.binary:
+            return {'bytes_data': self.codec.dumps(payload)}
+        return {'text_data': self.codec.dumps(payload)}
+
+    async def send_frame(self, frame):
+        await self.send(**frame)
+
+    async def send_payload(self, payload, message_id=None, cursors=None):
+        """Encode one event and queue it for the socket"""
+        await self.enqueue(self.encode_frame(payload), message_id=message_id, cursors=cursors)
+
+    async def send_event(self, event):
+        """Queue a codec.encode_event() frame; only msgpack sockets re-encode it"""
+        if event.get('exclude') == self.channel_name:
+            # Room-wide event this socket already answered for itself
+            return
+        frame = {'bytes_data': codec.event_msgpack(event)} if self.codec.binary else {'text_data': event['text']}
+        cursors = {event['chatroom_id']: event['seq']} if 'seq' in event else None
+        await self.enqueue(frame, coalesce=event.get('coalesce'), message_id=event.get('message_id'), cursors=cursors)
+
+    async def enqueue(self, frame, coalesce=None, message_id=None, cursors=None):
+        if not self.outbound.put(frame, coalesce=coalesce, message_id=message_id, cursors=cursors):
+            await self.evict_slow_consumer()
+
+    async def evict_slow_consumer(self):
+        """Disconnect a client that has fallen CHAT_OUTBOUND_QUEUE_LIMIT frames behind.
+        
+        Nothing queued is dropped silently: the client is told the newest
+        seq that actually reached it in each room, and the newest message id
+        for rooms it has no cursor for, then reconnects and fetches the rest
+        with sync.
+        """
+        queued = len(self.outbound)
+        self.outbound.close()
+        ws_slow_consumer_evictions.inc()
+        logger.warning("Evicting slow consumer user_id=%s queued=%s", self.user.id, queued)
+        hint = self.encode_frame({
+            'type': 'resume',
+            'reason': 'slow_consumer',
+            'cursors': {str(room_id): seq for room_id, seq in self.outbound.cursors.items()},
+            'after_id': self.outbound.delivered_id
+        })
+        try:
+            await asyncio.wait_for(self.send_frame(hint), RESUME_HINT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
     # WebSocket event handlers (called by group_send)
     async def chat_message_handler(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'sender_id': event['sender_id'],
-            'sender_username': event['sender_username']
-        }))
+        await self.send_event(event)
 
     async def typing_indicator_handler(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing_indicator',
-            'sender_id': event['sender_id'],
-            'sender_username': event['sender_username'],
-            'is_typing': event['is_typing']
-        }))
+        await self.send_event(event)
 
     async def read_receipt_handler(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'read_receipt',
-            'message_id': event['message_id'],
-            'read_by_id': event['read_by_id'],
-            'read_by_username': event['read_by_username']
-        }))
\ No newline at end of file
+        await self.send_event(event)
+
+    async def read_up_to_handler(self, event):
+        await self.send_event(event)
+
+    async def room_membership_handler(self, event):
+        # Joined or left a group room (chat.groups.notify_membership)
+        room_id = event['chatroom_id']
+        if event['joined']:
+            self.group_rooms.add(room_id)
+            await self.channel_layer.group_add(room_group(room_id), self.channel_name)
+        else:
+            self.group_rooms.discard(room_id)
+            await self.channel_layer.group_discard(room_group(room_id), self.channel_name)
+        await self.send_event(event)
@@ -0,0 +1,81 @@
+"""
+ORM calls made from the event loop.
+
+channels' database_sync_to_async is thread sensitive: every call in a
+process runs on one shared thread, so a worker never uses more than one
+database connection for WebSocket traffic however large the pool is. With
+DB_THREAD_POOL_SIZE above 1 the calls run on a dedicated pool of that many
+threads instead. Each thread holds at most one connection, so the size
+should not exceed the database pool (DB_POOL_MAX_SIZE); see settings.py.
+
+Every wrapped function must do its work, including any transaction, within
+the single call, since consecutive calls may land on different threads.
+
+Calls are timed into chat.metrics: the wait for a free thread, the time
+spent on it per operation, and how many calls are in flight.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+from chat.metrics import db_calls_in_flight, db_queue_seconds, db_seconds, db_threads
+
+# When the current call was handed to the executor; copied into the thread
+_submitted_at = contextvars.ContextVar('db_submitted_at')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_thread_pool_size():
+    return getattr(settings, 'DB_THREAD_POOL_SIZE', 1)
+
+
+db_threads.set(get_thread_pool_size())
+
+
+def get_db_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_thread_pool_size(),
+                thread_name_prefix='chat-db',
+            )
+        return _executor
+
+
+class InstrumentedSyncToAsync(DatabaseSyncToAsync):
+    def __init__(self, func, **kwargs):
+        super().__init__(func, **kwargs)
+        timer = db_seconds.labels(func.__qualname__)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            db_queue_seconds.observe(started - _submitted_at.get(started))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.observe(time.perf_counter() - started)
+
+        self.func = timed
+
+    async def __call__(self, *args, **kwargs):
+        token = _submitted_at.set(time.perf_counter())
+        db_calls_in_flight.inc()
+        try:
+            return await super().__call__(*args, **kwargs)
+        finally:
+            db_calls_in_flight.dec()
+            _submitted_at.reset(token)
+
+
+def database_sync_to_async(func):
+    """Drop-in for channels.db.database_sync_to_async using the DB thread pool"""
+    if get_thread_pool_size() <= 1:
+        return InstrumentedSyncToAsync(func)
+    return InstrumentedSyncToAsync(func, thread_sensitive=False, executor=get_db_executor())
@@ -0,0 +1,38 @@
+"""
+Channel-layer groups for group rooms.
+
+Every socket of every member joins ``room_<id>`` on connect, so a message
+to a group room is one group_send however many members it has. Sockets
+learn about membership changes through a room_joined/room_left event on
+their ``user_<id>`` group, and join or leave the room group there and then.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from chat import codec
+
+
+def room_group(room_id):
+    return f'room_{room_id}'
+
+
+def membership_event(room, joined):
+    event = codec.encode_event('room_membership_handler', {
+        'type': 'room_joined' if joined else 'room_left',
+        'chatroom_id': room.id,
+        'name': room.name,
+    })
+    # Read by the consumer; the encoded frame is forwarded as is
+    event['chatroom_id'] = room.id
+    event['joined'] = joined
+    return event
+
+
+def notify_membership(room, user_ids, joined):
+    """Tell each user's open sockets they joined or left ``room`` (sync callers)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    event = membership_event(room, joined)
+    for user_id in user_ids:
+        async_to_sync(channel_layer.group_send)(f'user_{user_id}', event)
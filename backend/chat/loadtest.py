@@ -0,0 +1,338 @@
+"""
+Load harness for ChatConsumer.
+
+Connects many authenticated clients to ws/chat/ through the same stack as
+backend.asgi (JWTAuthMiddleware + URLRouter), on the in-memory channel
+layer and the in-process presence store, and drives a mix of operations:
+
+  chat_message - latency from send to delivery at the receiver
+  typing       - alternating start/stop, so every event is a state change
+                 the throttle forwards; latency to the receiver
+  read_up_to   - for the newest unread message from a peer; latency until
+                 the receipt reaches its sender
+
+Each client keeps one chat message in flight, waiting for its message_sent
+before the next frame. Peers and operations come from a seeded RNG. Used by ``manage.py loadtest`` and
+by the tests.
+"""
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from unittest import mock
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.codec import MSGPACK_SUBPROTOCOL, MsgpackCodec, StdlibCodec
+from chat.middleware import JWTAuthMiddleware
+from chat.presence import get_presence
+from chat.routing import websocket_urlpatterns
+
+MIXES = {
+    'chat': {'chat_message': 1.0},
+    'typing': {'chat_message': 0.2, 'typing': 0.8},
+    'read': {'chat_message': 0.5, 'read_up_to': 0.5},
+    'mixed': {'chat_message': 0.6, 'typing': 0.3, 'read_up_to': 0.1},
+}
+
+LOAD_TEST_SETTINGS = {
+    'CHANNEL_LAYERS': {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': 10000},
+        },
+    },
+    'PRESENCE_BACKEND': 'chat.presence.LocalPresenceStore',
+    'PRESENCE_OFFLINE_GRACE_SECONDS': 0,
+    'TOKEN_REVOCATION_BACKEND': 'chat.revocation.LocalRevocationStore',
+}
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements run on any thread, including the ORM's worker threads"""
+    counter = {'queries': 0}
+    execute, executemany = CursorWrapper.execute, CursorWrapper.executemany
+
+    def counted_execute(self, sql, params=None):
+        counter['queries'] += 1
+        return execute(self, sql, params)
+
+    def counted_executemany(self, sql, param_list):
+        counter['queries'] += 1
+        return executemany(self, sql, param_list)
+
+    with mock.patch.object(CursorWrapper, 'execute', counted_execute), \
+            mock.patch.object(CursorWrapper, 'executemany', counted_executemany):
+        yield counter
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def create_users(count, prefix='loadtest'):
+    User.objects.bulk_create([
+        User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com')
+        for i in range(count)
+    ], ignore_conflicts=True)
+    return list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id')[:count])
+
+
+class LoadClient:
+    def __init__(self, run, user, token):
+        self.run = run
+        self.user = user
+        self.codec = MsgpackCodec if run.protocol == 'msgpack' else StdlibCodec
+        self.communicator = WebsocketCommunicator(
+            run.application, f'/ws/chat/?token={token}',
+            subprotocols=[MSGPACK_SUBPROTOCOL] if run.protocol == 'msgpack' else None,
+        )
+        # peer_id -> newest message id received from that peer and not yet read
+        self.unread = {}
+        # peer_id -> is_typing sent last
+        self.typing = {}
+        # Resolved by the next message_sent (or error) frame
+        self.ack = None
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=self.run.timeout)
+        if not connected:
+            raise RuntimeError(f'WebSocket rejected for {self.user.username}')
+        frame = await self.receive(self.run.timeout)
+        assert frame['type'] == 'connection', frame
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            frame = await self.receive(3600)
+            self.run.received(self, frame)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect(timeout=self.run.timeout)
+
+    async def send(self, frame):
+        data = self.codec.dumps(frame)
+        self.run.bytes_sent += len(data)
+        if self.codec.binary:
+            await self.communicator.send_to(bytes_data=data)
+        else:
+            await self.communicator.send_to(text_data=data)
+
+    async def receive(self, timeout):
+        response = await self.communicator.receive_output(timeout)
+        if response['type'] == 'websocket.close':
+            raise RuntimeError(f'WebSocket closed for {self.user.username}')
+        data = response.get('bytes') if response.get('bytes') is not None else response['text']
+        self.run.bytes_received += len(data)
+        return self.codec.loads(data)
+
+
+class LoadTestRun:
+    """One load test: ``clients`` connections each sending ``operations`` frames"""
+
+    def __init__(self, users, tokens, operations=20, mix='chat', seed=0, interval=0.0, timeout=10.0,
+                 protocol='json'):
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        self.users = users
+        self.tokens = tokens
+        self.operations = operations
+        self.weights = MIXES[mix] if isinstance(mix, str) else mix
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.interval = interval
+        self.timeout = timeout
+        self.protocol = protocol
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self.sent = defaultdict(int)
+        self.delivered = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        # Pending deliveries keyed by what the receiving frame carries
+        self.pending_chat = {}
+        self.pending_typing = defaultdict(deque)
+        self.pending_reads = {}
+
+    def received(self, client, frame):
+        now = time.perf_counter()
+        kind = frame.get('type')
+        if kind == 'chat_message':
+            message = frame['message']
+            client.unread[message['sender_id']] = message['id']
+            sent_at = self.pending_chat.pop(message['content'], None)
+            if sent_at is not None:
+                self.record('chat_message', now - sent_at)
+        elif kind == 'typing_indicator':
+            queue = self.pending_typing[(frame['sender_id'], client.user.id)]
+            # Anything else is an automatic stop from the throttle
+            if queue and queue[0][0] == frame['is_typing']:
+                self.record('typing', now - queue.popleft()[1])
+        elif kind == 'read_up_to':
+            sent_at = self.pending_reads.pop((frame['read_by_id'], frame['message_id']), None)
+            if sent_at is not None:
+                self.record('read_up_to', now - sent_at)
+        elif kind == 'message_sent':
+            self.acknowledge(client)
+        elif kind == 'error':
+            self.errors += 1
+            self.acknowledge(client)
+
+    def acknowledge(self, client):
+        if client.ack is not None and not client.ack.done():
+            client.ack.set_result(None)
+
+    def record(self, kind, latency):
+        self.delivered[kind] += 1
+        self.latencies[kind].append(latency)
+
+    def next_operation(self, client):
+        kind = self.random.choices(list(self.weights), list(self.weights.values()))[0]
+        if kind == 'read_up_to':
+            if client.unread:
+                peer_id = self.random.choice(sorted(client.unread))
+                return kind, {'type': 'read_up_to', 'message_id': client.unread.pop(peer_id)}
+            # Nothing to read yet
+            kind = 'chat_message'
+
+        peer = self.random.choice([user for user in self.users if user.id != client.user.id])
+        if kind == 'typing':
+            is_typing = not client.typing.get(peer.id, False)
+            client.typing[peer.id] = is_typing
+            return kind, {'type': 'typing', 'receiver_id': peer.id, 'is_typing': is_typing}
+        return kind, {'type': 'chat_message', 'receiver_id': peer.id}
+
+    async def drive(self, client):
+        for seq in range(self.operations):
+            kind, frame = self.next_operation(client)
+            now = time.perf_counter()
+            if kind == 'chat_message':
+                frame['content'] = f'lt:{client.user.id}:{seq}'
+                self.pending_chat[frame['content']] = now
+            elif kind == 'typing':
+                self.pending_typing[(client.user.id, frame['receiver_id'])].append((frame['is_typing'], now))
+            else:
+                self.pending_reads[(client.user.id, frame['message_id'])] = now
+            self.sent[kind] += 1
+            if kind == 'chat_message':
+                client.ack = asyncio.get_running_loop().create_future()
+            await client.send(frame)
+            if kind == 'chat_message':
+                # Closed loop: one message in flight per client, so latency
+                # is not just the time spent queued behind our own sends
+                await asyncio.wait_for(client.ack, self.timeout)
+            await asyncio.sleep(self.interval)
+
+    def pending(self):
+        return len(self.pending_chat) + sum(len(queue) for queue in self.pending_typing.values())
+
+    async def drain(self):
+        deadline = time.perf_counter() + self.timeout
+        while self.pending() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        # Receipts carry no guarantee of being sent (count may be 0)
+        await asyncio.sleep(0.05)
+
+    async def execute(self):
+        clients = [LoadClient(self, user, self.tokens[user.id]) for user in self.users]
+        for client in clients:
+            await client.connect()
+
+        with count_queries() as counter:
+            started = time.perf_counter()
+            await asyncio.gather(*(self.drive(client) for client in clients))
+            await self.drain()
+            elapsed = time.perf_counter() - started
+            queries = counter['queries']
+
+        for client in clients:
+            await client.close()
+        await get_presence().close()
+        return self.report(elapsed, queries)
+
+    def report(self, elapsed, queries):
+        operations = sum(self.sent.values())
+        report = {
+            'mix': self.mix if isinstance(self.mix, str) else 'custom',
+            'clients': len(self.users),
+            'operations': operations,
+            'elapsed': elapsed,
+            'operations_per_second': operations / elapsed if elapsed else 0.0,
+            'messages_per_second': self.delivered['chat_message'] / elapsed if elapsed else 0.0,
+            'queries': queries,
+            'queries_per_operation': queries / operations if operations else 0.0,
+            'queries_per_message': queries / self.sent['chat_message'] if self.sent['chat_message'] else None,
+            'protocol': self.protocol,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'errors': self.errors,
+            'events': {},
+        }
+        for kind in MIXES['mixed']:
+            latencies = sorted(self.latencies[kind])
+            report['events'][kind] = {
+                'sent': self.sent[kind],
+                'delivered': self.delivered[kind],
+                'p50_ms': _ms(percentile(latencies, 50)),
+                'p95_ms': _ms(percentile(latencies, 95)),
+                'p99_ms': _ms(percentile(latencies, 99)),
+                'max_ms': _ms(latencies[-1] if latencies else None),
+            }
+        return report
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def run_load_test(clients=10, operations=20, mix='chat', seed=0, interval=0.0, timeout=10.0, prefix='loadtest',
+                  protocol='json'):
+    """Create ``clients`` users and run one load test against them.
+
+    Needs a database with migrations applied; the caller is responsible for
+    it being a disposable one (the test database).
+    """
+    from asgiref.sync import async_to_sync
+
+    users = create_users(clients, prefix)
+    tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+    with override_settings(**LOAD_TEST_SETTINGS):
+        run = LoadTestRun(users, tokens, operations=operations, mix=mix, seed=seed,
+                          interval=interval, timeout=timeout, protocol=protocol)
+        return async_to_sync(run.execute)()
+
+
+def format_report(report):
+    lines = [
+        f"mix={report['mix']} protocol={report['protocol']} clients={report['clients']} "
+        f"operations={report['operations']} elapsed={report['elapsed']:.2f}s",
+        f"  {report['operations_per_second']:.0f} ops/s, {report['messages_per_second']:.0f} messages/s, "
+        f"{report['queries_per_operation']:.2f} queries/op"
+        + (f", {report['queries_per_message']:.2f} queries/message" if report['queries_per_message'] else '')
+        + f", {report['errors']} errors",
+        f"  {report['bytes_sent']} bytes sent, {report['bytes_received']} bytes received",
+        f"  {'event':<14}{'sent':>8}{'delivered':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}",
+    ]
+    for kind, stats in report['events'].items():
+        if not stats['sent']:
+            continue
+        row = f"  {kind:<14}{stats['sent']:>8}{stats['delivered']:>11}"
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            value = stats[key]
+            row += f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+        lines.append(row)
+    return '\n'.join(lines)
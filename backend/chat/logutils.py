@@ -0,0 +1,31 @@
+import logging
+import random
+
+from django.conf import settings
+
+
+class HotPathLogger:
+    """Logging for per-frame WebSocket events.
+
+    Arguments are passed %-style so nothing is formatted unless the record
+    is emitted. ``sampled`` emits only CHAT_LOG_SAMPLE_RATE of the calls;
+    ``body`` is for anything containing message content and logs at
+    CHAT_MESSAGE_LOG_LEVEL (DEBUG by default, and also when the setting is
+    not a level name) so content stays out of production logs.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def sampled(self, msg, *args, level=logging.INFO):
+        if self.logger.isEnabledFor(level) and random.random() < getattr(settings, 'CHAT_LOG_SAMPLE_RATE', 1.0):
+            self.logger.log(level, msg, *args)
+
+    def body(self, msg, *args):
+        level = logging.getLevelName(str(getattr(settings, 'CHAT_MESSAGE_LOG_LEVEL', 'DEBUG')).upper())
+        if not isinstance(level, int):
+            # getLevelName() returns "Level X" for names it doesn't know; a
+            # typo must not start logging message content
+            level = logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, *args)
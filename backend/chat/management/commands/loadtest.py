@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.loadtest import MIXES, format_report, run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive concurrent ws/chat/ clients against ChatConsumer and report "
+        "latency percentiles, throughput and queries per message. Runs "
+        "against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--operations', type=int, default=50,
+                            help='Frames sent by each client')
+        parser.add_argument('--mix', choices=[*MIXES, 'all'], default='all')
+        parser.add_argument('--protocol', choices=['json', 'msgpack'], default='json',
+                            help='WebSocket subprotocol the clients negotiate')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--interval', type=float, default=0.0,
+                            help='Seconds each client waits between frames')
+        parser.add_argument('--timeout', type=float, default=30.0,
+                            help='Seconds to wait for outstanding deliveries')
+        parser.add_argument('--json', action='store_true', help='Print reports as JSON')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 2:
+            raise CommandError('--clients must be at least 2')
+        mixes = list(MIXES) if options['mix'] == 'all' else [options['mix']]
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            reports = []
+            for index, mix in enumerate(mixes):
+                report = run_load_test(
+                    clients=options['clients'],
+                    operations=options['operations'],
+                    mix=mix,
+                    seed=options['seed'] + index,
+                    interval=options['interval'],
+                    timeout=options['timeout'],
+                    # Fresh users per mix, so each starts without rooms
+                    prefix=f'loadtest_{mix}',
+                    protocol=options['protocol'],
+                )
+                reports.append(report)
+                if not options['json']:
+                    self.stdout.write(format_report(report))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
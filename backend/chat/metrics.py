@@ -0,0 +1,82 @@
+"""
+Prometheus metrics, served at /metrics/.
+
+Gunicorn runs several worker processes, and a scrape reaches whichever one
+accepts it. So under gunicorn every worker records into files in
+PROMETHEUS_MULTIPROC_DIR (prometheus_client's multiprocess mode, set up in
+gunicorn.conf.py), and render() aggregates all of them. A scrape of any
+worker then returns the totals for the whole server, and a recycled worker
+leaves no series of its own behind. Without PROMETHEUS_MULTIPROC_DIR (tests,
+runserver) the process's own registry is served.
+"""
+import os
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def render():
+    """The text exposition of every metric, summed over live and past workers"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+# WebSocket connections (chat.consumers)
+ws_connections = Gauge(
+    'chat_ws_connections', 'Open WebSocket connections', multiprocess_mode='livesum')
+ws_connects = Counter(
+    'chat_ws_connects', 'WebSocket connection attempts', ['result'])
+ws_event_seconds = Histogram(
+    'chat_ws_event_seconds', 'Time to handle one inbound WebSocket frame', ['event'], buckets=DEFAULT_BUCKETS)
+ws_group_send_seconds = Histogram(
+    'chat_ws_group_send_seconds', 'Channel-layer group_send latency', ['event'], buckets=DEFAULT_BUCKETS)
+
+# Per-connection outbound queues (chat.outbound)
+ws_outbound_queued = Gauge(
+    'chat_ws_outbound_queued', 'Frames waiting in outbound queues across all connections',
+    multiprocess_mode='livesum')
+ws_outbound_depth = Histogram(
+    'chat_ws_outbound_depth', 'Outbound queue depth found by each new frame',
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+ws_outbound_frames = Counter(
+    'chat_ws_outbound_frames', 'Outbound frames by outcome', ['outcome'])
+ws_slow_consumer_evictions = Counter(
+    'chat_ws_slow_consumer_evictions', 'Connections closed because their outbound queue was full')
+
+# Handshake authentication (chat.middleware, chat.revocation)
+ws_auth_seconds = Histogram(
+    'chat_ws_auth_seconds', 'WebSocket token authentication time', ['source'], buckets=DEFAULT_BUCKETS)
+ws_auth = Counter(
+    'chat_ws_auth', 'WebSocket authentication results', ['result'])
+token_revocation_checks = Counter(
+    'chat_token_revocation_checks', 'JWT revocation lookups by outcome', ['result'])
+
+# ORM calls made from the event loop (chat.db)
+db_seconds = Histogram(
+    'chat_db_seconds', 'Time spent running an ORM call on a DB thread', ['operation'], buckets=DEFAULT_BUCKETS)
+db_queue_seconds = Histogram(
+    'chat_db_queue_seconds', 'Time an ORM call waited for a free DB thread', buckets=DEFAULT_BUCKETS)
+db_calls_in_flight = Gauge(
+    'chat_db_calls_in_flight', 'ORM calls submitted from the event loop and not finished yet',
+    multiprocess_mode='livesum')
+db_threads = Gauge(
+    'chat_db_threads', 'Threads available for ORM calls from the event loop', multiprocess_mode='livesum')
+
+# Password hashing pool (chat.passwords)
+password_hash_seconds = Histogram(
+    'chat_password_hash_seconds', 'Time spent hashing or verifying one password', ['operation'],
+    buckets=DEFAULT_BUCKETS)
+password_hash_queue_seconds = Histogram(
+    'chat_password_hash_queue_seconds', 'Time a password waited for a free hashing thread', buckets=DEFAULT_BUCKETS)
+
+# REST API (chat.middleware.RequestMetricsMiddleware)
+http_request_seconds = Histogram(
+    'chat_http_request_seconds', 'HTTP request duration', ['route', 'method', 'status'], buckets=DEFAULT_BUCKETS)
+
+# Typing indicators (chat.typing_indicators)
+typing_events = Counter(
+    'chat_typing_events', 'Typing indicator events by outcome', ['outcome'])
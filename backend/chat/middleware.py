@@ -1,79 +1,199 @@
-import jwt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qs
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
+from chat.db import database_sync_to_async
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from chat.revocation import ais_revoked
+from chat.metrics import http_request_seconds, ws_auth, ws_auth_seconds
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+
+class TokenUserCache:
+    """Bounded LRU of validated access tokens to (user snapshot, jti).
+
+    An entry lives until the token's ``exp`` or ``ttl`` seconds, whichever
+    comes first, so a cached handshake never outlives the token itself. The
+    jti is kept so cached tokens are still checked for revocation.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot, jti = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return snapshot, jti
+
+    def set(self, token, snapshot, token_exp, jti):
+        if self.max_size <= 0:
+            return
+        expires_at = min(token_exp, time.time() + self.ttl)
+        key = self.key(token)
+        with self.lock:
+            self.entries[key] = (expires_at, snapshot, jti)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_user_cache = TokenUserCache(
+    max_size=getattr(settings, 'WS_AUTH_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'WS_AUTH_CACHE_TTL', 300),
+)
+
+
+def user_from_snapshot(snapshot):
+    # A fresh unsaved instance per connection; consumers only read these fields
+    return User(**snapshot)
+
+
 @database_sync_to_async
 def get_user_from_jwt(token):
+    """(user, jti) for a token; AnonymousUser and no jti if it is unusable"""
     try:
-        print(f'🔑 Attempting to decode JWT token: {token[:20]}...')
-        
         # Use SimpleJWT's AccessToken to decode
         access_token = AccessToken(token)
-        print(f'✓ JWT decoded successfully using SimpleJWT')
-        
+        jti = access_token.get(jwt_settings.JTI_CLAIM)
+
         user_id = access_token.get('user_id')
         if not user_id:
-            print('❌ JWT payload missing user_id')
-            return AnonymousUser()
-        
-        print(f'✓ Extracted user_id: {user_id}')
-        
+            logger.warning("ws_auth result=rejected reason=missing_user_id")
+            return AnonymousUser(), None
+
         try:
-            user = User.objects.get(id=user_id)
-            print(f'✓ User found: {user.username} (ID: {user.id})')
-            return user
+            user = User.objects.only('id', 'username', 'email', 'is_active').get(id=user_id)
         except User.DoesNotExist:
-            print(f'❌ User with id {user_id} does not exist in database')
-            return AnonymousUser()
-            
-    except TokenError as e:
-        print(f'❌ SimpleJWT TokenError: {e}')
-        return AnonymousUser()
-    except InvalidToken as e:
-        print(f'❌ Invalid JWT token: {e}')
-        return AnonymousUser()
-    except Exception as e:
-        print(f'❌ Unexpected error decoding JWT: {type(e).__name__}: {e}')
-        import traceback
-        print(traceback.format_exc())
+            logger.warning("ws_auth result=rejected reason=unknown_user user_id=%s", user_id)
+            return AnonymousUser(), None
+
+        token_user_cache.set(
+            token,
+            {'id': user.id, 'username': user.username, 'email': user.email, 'is_active': user.is_active},
+            access_token['exp'],
+            jti,
+        )
+        return user, jti
+
+    except (TokenError, InvalidToken) as e:
+        logger.info("ws_auth result=rejected reason=invalid_token error=%s", e)
+        return AnonymousUser(), None
+    except Exception:
+        logger.exception("ws_auth result=error")
+        return AnonymousUser(), None
+
+
+async def resolve_user(token):
+    """Cached snapshot for a token seen before, else decode + DB lookup.
+
+    Either way the token's jti is then checked against chat.revocation.
+    """
+    with ws_auth_seconds.labels('cache').time():
+        cached = token_user_cache.get(token)
+    if cached is not None:
+        snapshot, jti = cached
+        user = user_from_snapshot(snapshot)
+    else:
+        with ws_auth_seconds.labels('db').time():
+            user, jti = await get_user_from_jwt(token)
+
+    if await ais_revoked(jti):
+        logger.info("ws_auth result=rejected reason=revoked user_id=%s", user.id)
         return AnonymousUser()
+    if cached is not None:
+        logger.debug("ws_auth result=accepted source=cache user_id=%s", user.id)
+    return user
 
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
-        print('='*80)
-        print('🌐 NEW WEBSOCKET CONNECTION ATTEMPT')
-        print('='*80)
-        
-        query_string = scope.get('query_string', b'').decode()
-        print(f'📡 Query string: {query_string}')
-        
-        query_params = parse_qs(query_string)
+        query_params = parse_qs(scope.get('query_string', b'').decode())
         token = query_params.get('token', [None])[0]
-        
+
         if token:
-            print(f'🎫 Token found (length: {len(token)})')
-            user = await get_user_from_jwt(token)
+            user = await resolve_user(token)
             scope['user'] = user
-            
+
             if isinstance(user, AnonymousUser):
-                print('❌ AUTHENTICATION FAILED - User is AnonymousUser')
+                ws_auth.labels('rejected').inc()
+                logger.info("ws_auth result=rejected path=%s", scope.get('path'))
             else:
-                print(f'✓✓✓ AUTHENTICATION SUCCESSFUL ✓✓✓')
-                print(f'✓ User: {user.username} (ID: {user.id})')
+                ws_auth.labels('accepted').inc()
+                logger.debug("ws_auth result=accepted user_id=%s", user.id)
         else:
-            print('❌ NO TOKEN provided in query string')
+            ws_auth.labels('no_token').inc()
+            logger.info("ws_auth result=rejected reason=no_token path=%s", scope.get('path'))
             scope['user'] = AnonymousUser()
-        
-        print('='*80)
+
         return await super().__call__(scope, receive, send)
+
+
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class RequestMetricsMiddleware:
+    """Django middleware timing every HTTP request into chat_http_request_seconds.
+
+    Labelled by URL route pattern rather than path, so ids in the URL do not
+    create new series. Works under both WSGI and ASGI without a thread hop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, started):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        http_request_seconds.labels(route, method, f'{response.status_code // 100}xx').observe(
+            time.perf_counter() - started
+        )
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_pair_keys(apps, schema_editor):
+    """Set low_user/high_user on existing direct rooms.
+
+    Rooms that resolve to an already keyed pair are duplicates left behind by
+    the old participant-count lookup: their messages are moved into the first
+    room for that pair and the empty duplicate is removed.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Chat = apps.get_model('chat', 'Chat')
+    Membership = ChatRoom.participants.through
+
+    members = {}
+    for room_id, user_id in Membership.objects.order_by('chatroom_id').values_list('chatroom_id', 'user_id'):
+        members.setdefault(room_id, set()).add(user_id)
+
+    canonical = {}
+    for room_id in ChatRoom.objects.order_by('id').values_list('id', flat=True):
+        user_ids = sorted(members.get(room_id, ()))
+        if not 1 <= len(user_ids) <= 2:
+            continue
+        key = (user_ids[0], user_ids[-1])
+
+        if key in canonical:
+            Chat.objects.filter(chatroom_id=room_id).update(chatroom_id=canonical[key])
+            ChatRoom.objects.filter(id=room_id).delete()
+            continue
+
+        canonical[key] = room_id
+        ChatRoom.objects.filter(id=room_id).update(low_user_id=key[0], high_user_id=key[1])
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Fire the deferred FK checks queued by the moves and deletes now;
+        # AddConstraint can't ALTER chat_chatroom while they are pending
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_alter_userstatus_last_seen'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='high_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='low_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('low_user', 'high_user'), name='unique_direct_room_pair'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatroom_pair_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['chatroom', 'timestamp', 'id'], name='chat_room_ts_id_idx'),
+        ),
+    ]
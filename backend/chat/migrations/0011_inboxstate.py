@@ -0,0 +1,61 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_inbox_states(apps, schema_editor):
+    """Create an inbox row per (room, participant) from the existing history"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Chat = apps.get_model('chat', 'Chat')
+    InboxState = apps.get_model('chat', 'InboxState')
+
+    unread = {
+        (row['chatroom_id'], row['receiver_id']): row['count']
+        for row in Chat.objects.filter(is_read=False)
+        .values('chatroom_id', 'receiver_id')
+        .annotate(count=models.Count('id'))
+    }
+
+    states = []
+    for room in ChatRoom.objects.prefetch_related('participants').iterator(chunk_size=500):
+        last_message = Chat.objects.filter(chatroom_id=room.id).order_by('-timestamp', '-id').first()
+        last_activity = last_message.timestamp if last_message else room.updated_at
+        for user in room.participants.all():
+            states.append(InboxState(
+                room_id=room.id,
+                user_id=user.id,
+                last_message=last_message,
+                last_activity=last_activity,
+                unread_count=unread.get((room.id, user.id), 0),
+            ))
+    InboxState.objects.bulk_create(states, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_chat_room_ts_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.chat')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_states', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity'], name='inbox_user_activity_idx')],
+                'constraints': [models.UniqueConstraint(fields=('room', 'user'), name='unique_inbox_state')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox_states, migrations.RunPython.noop),
+    ]
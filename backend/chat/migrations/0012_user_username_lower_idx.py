@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def username_lower_index(schema_editor):
+    # varchar_pattern_ops lets Postgres serve LIKE 'prefix%' from the index
+    expression = Lower('username')
+    if schema_editor.connection.vendor == 'postgresql':
+        expression = models.indexes.OpClass(expression, name='varchar_pattern_ops')
+    return models.Index(expression, name='auth_user_username_lower_idx')
+
+
+def add_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('auth', 'User'), username_lower_index(schema_editor))
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('auth', 'User'), username_lower_index(schema_editor))
+
+
+class Migration(migrations.Migration):
+    """Index on lower(auth_user.username) backing the user directory search"""
+
+    dependencies = [
+        ('chat', '0011_inboxstate'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_user_username_lower_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['receiver', 'id'], name='chat_receiver_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['sender', 'id'], name='chat_sender_id_idx'),
+        ),
+    ]
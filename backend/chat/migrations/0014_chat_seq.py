@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_seqs(apps, schema_editor):
+    """Number existing messages 1..n per room in (timestamp, id) order"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Chat = apps.get_model('chat', 'Chat')
+
+    for room_id in ChatRoom.objects.order_by('id').values_list('id', flat=True).iterator():
+        messages = list(Chat.objects.filter(chatroom_id=room_id).order_by('timestamp', 'id').only('id'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        Chat.objects.bulk_update(messages, ['seq'], batch_size=1000)
+        ChatRoom.objects.filter(id=room_id).update(last_seq=len(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_chat_sync_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_seqs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chat',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='chat',
+            constraint=models.UniqueConstraint(fields=('chatroom', 'seq'), name='unique_chat_room_seq'),
+        ),
+        # Superseded by unique_chat_room_seq
+        migrations.RemoveIndex(
+            model_name='chat',
+            name='chat_room_ts_id_idx',
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# External-content FTS5 table over chat_chat.content, kept in step by triggers.
+# SQLite drops a table's triggers with it, so a later migration that makes
+# Django rebuild chat_chat on SQLite has to run SQLITE_TRIGGERS again.
+SQLITE_TABLE = [
+    "CREATE VIRTUAL TABLE chat_chat_fts USING fts5("
+    "content, content='chat_chat', content_rowid='id', tokenize='porter unicode61')",
+]
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER chat_chat_fts_insert AFTER INSERT ON chat_chat BEGIN "
+    "INSERT INTO chat_chat_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER chat_chat_fts_delete AFTER DELETE ON chat_chat BEGIN "
+    "INSERT INTO chat_chat_fts(chat_chat_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER chat_chat_fts_update AFTER UPDATE OF content ON chat_chat BEGIN "
+    "INSERT INTO chat_chat_fts(chat_chat_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_chat_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+SQLITE_REBUILD = "INSERT INTO chat_chat_fts(chat_chat_fts) VALUES ('rebuild')"
+
+
+def content_search_index():
+    # Must compile to the same expression chat.search filters on
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return GinIndex(SearchVector('content', config='english'), name='chat_content_search_idx')
+
+
+def add_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('chat', 'Chat'), content_search_index())
+    elif vendor == 'sqlite':
+        for statement in SQLITE_TABLE + SQLITE_TRIGGERS + [SQLITE_REBUILD]:
+            schema_editor.execute(statement)
+
+
+def remove_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('chat', 'Chat'), content_search_index())
+    elif vendor == 'sqlite':
+        for name in ('insert', 'delete', 'update'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS chat_chat_fts_{name}")
+        schema_editor.execute("DROP TABLE IF EXISTS chat_chat_fts")
+
+
+class Migration(migrations.Migration):
+    """Full-text index on chat_chat.content backing chat.search"""
+
+    dependencies = [
+        ('chat', '0014_chat_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def email_lower_index():
+    return models.Index(Lower('email'), name='auth_user_email_lower_idx')
+
+
+def add_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('auth', 'User'), email_lower_index())
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('auth', 'User'), email_lower_index())
+
+
+class Migration(migrations.Migration):
+    """Index on lower(auth_user.email) backing the login and registration lookups"""
+
+    dependencies = [
+        ('chat', '0015_chat_content_search'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
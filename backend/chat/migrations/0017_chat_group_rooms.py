@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:39
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+content_search = import_module('chat.migrations.0015_chat_content_search')
+
+
+def restore_search_triggers(apps, schema_editor):
+    # Making receiver nullable rebuilds chat_chat on SQLite, which drops the
+    # FTS triggers along with the old table; the FTS rows themselves survive
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in content_search.SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_user_email_lower_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='is_group',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='inboxstate',
+            name='last_read_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        # Restores the triggers after the reverse AlterField rebuild
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AlterField(
+            model_name='chat',
+            name='receiver',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='received_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
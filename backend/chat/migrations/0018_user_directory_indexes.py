@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def directory_indexes(schema_editor):
+    # The 0012 pattern_ops index only serves LIKE; this one serves the
+    # ORDER BY lower(username), id and the keyset range of paginate_users
+    indexes = [models.Index(Lower('username'), 'id', name='auth_user_username_lower_id_idx')]
+    if schema_editor.connection.vendor == 'postgresql':
+        # Email prefix search; the plain lower(email) index from 0016 can't serve LIKE
+        indexes.append(models.Index(
+            models.indexes.OpClass(Lower('email'), name='varchar_pattern_ops'),
+            name='auth_user_email_lower_like_idx',
+        ))
+    return indexes
+
+
+def add_indexes(apps, schema_editor):
+    for index in directory_indexes(schema_editor):
+        schema_editor.add_index(apps.get_model('auth', 'User'), index)
+
+
+def remove_indexes(apps, schema_editor):
+    for index in directory_indexes(schema_editor):
+        schema_editor.remove_index(apps.get_model('auth', 'User'), index)
+
+
+class Migration(migrations.Migration):
+    """Indexes for the user directory's ordering, keyset and email prefix search"""
+
+    dependencies = [
+        ('chat', '0017_chat_group_rooms'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-17 13:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_user_directory_indexes'),
+    ]
+
+    # Sync reads (chatroom, seq) ranges per room now; nothing scans these
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chat',
+            name='chat_receiver_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='chat',
+            name='chat_sender_id_idx',
+        ),
+    ]
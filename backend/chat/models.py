@@ -1,41 +1,107 @@
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from django.contrib.auth.models import User
     
 
 class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms')
+    # Group rooms have a name and any number of participants; direct rooms
+    # have exactly two, keyed by low_user/high_user
+    is_group = models.BooleanField(default=False)
+    name = models.CharField(max_length=100, blank=True, default='')
+    # Canonical pair key for direct rooms: (min(user ids), max(user ids))
+    low_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    high_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    # Highest Chat.seq handed out in this room, see allocate_seqs
+    last_seq = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(fields=['low_user', 'high_user'], name='unique_direct_room_pair'),
+        ]
     
     def __str__(self):
+        if self.is_group:
+            return f"Group {self.name}"
         participant_names = [p.username for p in self.participants.all()]
         return f"Chat between {', '.join(participant_names)}"
     
+    @staticmethod
+    def pair_key(user1, user2):
+        """Return the (low_user_id, high_user_id) key for two users or user ids"""
+        id1 = getattr(user1, 'id', user1)
+        id2 = getattr(user2, 'id', user2)
+        return (id1, id2) if id1 <= id2 else (id2, id1)
+    
     @classmethod
     def get_or_create_room(cls, user1, user2):
-        # Ensure consistent ordering to avoid duplicate rooms
-        participants = sorted([user1.id, user2.id])
-        
-        # Try to find existing room with these exact participants
-        existing_room = cls.objects.filter(
-            participants__in=[user1, user2]
-        ).annotate(
-            participant_count=models.Count('participants')
-        ).filter(
-            participant_count=2
-        ).first()
+        low_id, high_id = cls.pair_key(user1, user2)
         
+        # Single probe on the unique (low_user, high_user) index
+        existing_room = cls.objects.filter(low_user_id=low_id, high_user_id=high_id).first()
         if existing_room:
             return existing_room
         
-        # Create new room
-        room = cls.objects.create()
-        room.participants.add(user1, user2)
+        # Create new room; a concurrent creator makes the insert fail on the
+        # unique constraint, in which case we return the room it created
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(low_user_id=low_id, high_user_id=high_id)
+                room.participants.add(low_id, high_id)
+                InboxState.objects.bulk_create([
+                    InboxState(room=room, user_id=user_id) for user_id in {low_id, high_id}
+                ])
+        except IntegrityError:
+            room = cls.objects.get(low_user_id=low_id, high_user_id=high_id)
+        return room
+    
+    @classmethod
+    def create_group(cls, name, user_ids):
+        with transaction.atomic():
+            room = cls.objects.create(name=name, is_group=True)
+            room.add_members(user_ids)
         return room
+    
+    def add_members(self, user_ids):
+        """Add users to a group room with their inbox rows; returns the ids that were new"""
+        existing = set(self.participants.filter(id__in=user_ids).values_list('id', flat=True))
+        new_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in existing]
+        if new_ids:
+            with transaction.atomic():
+                self.participants.add(*new_ids)
+                # Members start with the history already read
+                InboxState.objects.bulk_create([
+                    InboxState(room=self, user_id=user_id, last_read_seq=self.last_seq) for user_id in new_ids
+                ], ignore_conflicts=True)
+        return new_ids
+    
+    def remove_member(self, user_id):
+        with transaction.atomic():
+            self.participants.remove(user_id)
+            InboxState.objects.filter(room=self, user_id=user_id).delete()
+    
+    @classmethod
+    def allocate_seqs(cls, room_id, count=1, timestamp=None):
+        """Reserve ``count`` message sequence numbers in a room; returns the last one.
+        
+        One UPDATE ... RETURNING that also bumps updated_at. It locks the
+        room row until the surrounding transaction commits, so messages in
+        one room commit in seq order and a reader never sees seq n+1 before n.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET last_seq = last_seq + %s, updated_at = %s WHERE id = %s RETURNING last_seq',
+                [count, connection.ops.adapt_datetimefield_value(timestamp or timezone.now()), room_id],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise cls.DoesNotExist(f'ChatRoom {room_id} does not exist')
+        return row[0]
 
 
 class UserStatus(models.Model):
@@ -49,12 +115,138 @@ class UserStatus(models.Model):
     
 class Chat(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
-    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="received_messages")
+    # None for messages to a group room, which go to every other participant
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="received_messages", null=True, blank=True)
     chatroom = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='room', null=False, blank=False,default=0)
     content=models.CharField(max_length=1000)
     timestamp=models.DateTimeField(default=timezone.now)
     is_read=models.BooleanField(default=False)
+    # Position in the room: 1, 2, 3... with no gaps, assigned on insert
+    seq = models.PositiveBigIntegerField(editable=False)
     
+    class Meta:
+        constraints = [
+            # Also the index behind history pagination, read ranges and sync
+            models.UniqueConstraint(fields=['chatroom', 'seq'], name='unique_chat_room_seq'),
+        ]
     
     def __str__(self):
-        return f'{self.sender}-> {self.receiver}: {self.content[:30]}'
\ No newline at end of file
+        return f'{self.sender}-> {self.receiver}: {self.content[:30]}'
+    
+    def save(self, *args, **kwargs):
+        if self.seq is None:
+            # Same transaction as the insert, so a failed insert leaves no gap
+            with transaction.atomic(savepoint=False):
+                self.seq = ChatRoom.allocate_seqs(self.chatroom_id, timestamp=self.timestamp)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def assign_seqs(cls, messages):
+        """Give unsaved messages their seq, one allocation per room; call inside a transaction"""
+        by_room = {}
+        for message in messages:
+            by_room.setdefault(message.chatroom_id, []).append(message)
+        # Rooms are locked in id order, so two batches sharing rooms can't deadlock
+        for room_id, room_messages in sorted(by_room.items()):
+            last_seq = ChatRoom.allocate_seqs(
+                room_id, len(room_messages), timestamp=max(message.timestamp for message in room_messages)
+            )
+            for seq, message in enumerate(room_messages, start=last_seq - len(room_messages) + 1):
+                message.seq = seq
+
+
+class InboxState(models.Model):
+    """Per (room, user) inbox row maintained on every send and read"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='inbox_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_states')
+    last_message = models.ForeignKey(Chat, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_activity = models.DateTimeField(default=timezone.now)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Group rooms only: the user has read every message up to this seq
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_inbox_state'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_activity'], name='inbox_user_activity_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.user_id} in room {self.room_id}: {self.unread_count} unread'
+    
+    @classmethod
+    def record_message(cls, message):
+        """Move the room's inbox rows to ``message`` and bump the receiver's unread counter"""
+        cls.record_messages([message])
+    
+    @classmethod
+    def record_messages(cls, messages):
+        """Same as record_message for a batch: one UPDATE per room touched.
+        
+        A group message (no receiver) is unread for everyone in the room but
+        its sender: it adds one to the room-wide count and takes one back
+        from the sender.
+        """
+        latest = {}
+        unread = {}
+        group_counts = {}
+        for message in messages:
+            room_id = message.chatroom_id
+            current = latest.get(room_id)
+            if current is None or message.seq >= current.seq:
+                latest[room_id] = message
+            receivers = unread.setdefault(room_id, {})
+            if message.receiver_id is None:
+                group_counts[room_id] = group_counts.get(room_id, 0) + 1
+                receivers[message.sender_id] = receivers.get(message.sender_id, 0) - 1
+            else:
+                receivers[message.receiver_id] = receivers.get(message.receiver_id, 0) + 1
+        
+        # Room id order, the same as assign_seqs takes its room locks in
+        for room_id, message in sorted(latest.items()):
+            everyone = group_counts.get(room_id, 0)
+            cls.objects.filter(room_id=room_id).update(
+                last_message=message,
+                last_activity=message.timestamp,
+                unread_count=models.Case(
+                    *[
+                        models.When(user_id=user_id, then=models.F('unread_count') + everyone + count)
+                        for user_id, count in unread[room_id].items()
+                    ],
+                    default=models.F('unread_count') + everyone,
+                    output_field=models.PositiveIntegerField(),
+                ),
+            )
+    
+    @classmethod
+    def record_read(cls, room_id, user_id, count=1):
+        """Take ``count`` newly read messages off the user's unread counter"""
+        cls.objects.filter(room_id=room_id, user_id=user_id).update(
+            unread_count=Greatest(models.F('unread_count') - count, 0, output_field=models.PositiveIntegerField())
+        )
+    
+    @classmethod
+    def record_group_read(cls, room_id, user_id, seq):
+        """Mark a group room read up to ``seq``; returns how many unread messages that covered.
+        
+        0 when the user is no longer in the room (remove_member deleted the row).
+        """
+        with transaction.atomic():
+            state = cls.objects.select_for_update().only('id', 'last_read_seq').filter(
+                room_id=room_id, user_id=user_id,
+            ).first()
+            if state is None or seq <= state.last_read_seq:
+                return 0
+            # A range scan on (chatroom, seq) rather than a flag per message and reader
+            count = Chat.objects.filter(
+                chatroom_id=room_id, seq__gt=state.last_read_seq, seq__lte=seq,
+            ).exclude(sender_id=user_id).count()
+            cls.objects.filter(id=state.id).update(
+                last_read_seq=seq,
+                unread_count=Greatest(models.F('unread_count') - count, 0, output_field=models.PositiveIntegerField()),
+            )
+        return count
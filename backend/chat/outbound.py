@@ -0,0 +1,111 @@
+"""
+Bounded outbound queue between a ChatConsumer and its socket.
+
+Event handlers used to ``await self.send()`` themselves. Behind uvicorn
+that send waits for the client to read, so one slow phone stalled its
+consumer. Meanwhile its channel-layer queue filled until channels_redis
+started dropping events for it. Handlers now put frames on an
+OutboundQueue and return at once, and a writer task per connection sends
+them in order.
+
+- Typing frames carry a coalesce key. A newer one replaces a queued one
+  with the same key in place, and when the queue is full they are dropped.
+- Any other frame that finds the queue full is never dropped: put()
+  returns False and the consumer disconnects the client with a resume
+  hint. The client reconnects and catches up with ``sync``.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from chat.metrics import ws_outbound_depth, ws_outbound_frames, ws_outbound_queued
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """Frames waiting for one socket, sent in order by ``send(frame)``.
+
+    A frame is a dict of keyword arguments for AsyncWebsocketConsumer.send.
+    ``delivered_id`` is the newest message id among the frames already sent,
+    and ``cursors`` maps each room id to the newest seq sent from it.
+    """
+
+    def __init__(self, send, limit):
+        self.send = send
+        self.limit = limit
+        # [frame, coalesce key, message id, {room id: seq}] lists, oldest first
+        self.entries = deque()
+        self.coalescing = {}
+        self.ready = asyncio.Event()
+        self.delivered_id = 0
+        self.cursors = {}
+        self.closed = False
+        self.task = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def put(self, frame, coalesce=None, message_id=None, cursors=None):
+        """Queue ``frame``; False when it needs a slot and the queue is full"""
+        if self.closed:
+            return True
+        if coalesce is not None:
+            entry = self.coalescing.get(coalesce)
+            if entry is not None:
+                entry[0] = frame
+                ws_outbound_frames.labels('coalesced').inc()
+                return True
+
+        depth = len(self.entries)
+        ws_outbound_depth.observe(depth)
+        if depth >= self.limit:
+            if coalesce is not None:
+                ws_outbound_frames.labels('dropped').inc()
+                return True
+            return False
+
+        entry = [frame, coalesce, message_id, cursors]
+        self.entries.append(entry)
+        if coalesce is not None:
+            self.coalescing[coalesce] = entry
+        ws_outbound_frames.labels('queued').inc()
+        ws_outbound_queued.inc()
+        self.ready.set()
+        return True
+
+    async def run(self):
+        try:
+            while True:
+                while not self.entries:
+                    self.ready.clear()
+                    await self.ready.wait()
+                frame, coalesce, message_id, cursors = self.entries.popleft()
+                ws_outbound_queued.dec()
+                if coalesce is not None:
+                    del self.coalescing[coalesce]
+                await self.send(frame)
+                if message_id and message_id > self.delivered_id:
+                    self.delivered_id = message_id
+                if cursors:
+                    for room_id, seq in cursors.items():
+                        if seq > self.cursors.get(room_id, 0):
+                            self.cursors[room_id] = seq
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket is gone; disconnect() will follow
+            logger.warning("Outbound writer stopped: %s", e)
+            self.close()
+
+    def close(self):
+        """Stop the writer and drop whatever is still queued"""
+        self.closed = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        ws_outbound_queued.dec(len(self.entries))
+        self.entries.clear()
+        self.coalescing.clear()
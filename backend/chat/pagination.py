@@ -0,0 +1,148 @@
+import base64
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_values(*values):
+    """Opaque cursor for a keyset position"""
+    raw = '|'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_values(cursor, count):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        values = raw.rsplit('|', count - 1)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+    if len(values) != count:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    return values
+
+
+def encode_cursor(message):
+    """Opaque cursor for a message's position (its seq) in the room"""
+    return encode_values(message.seq)
+
+
+def decode_cursor(cursor):
+    value, = decode_values(cursor, 1)
+    try:
+        return int(value)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def message_position(cursor=None, seq=None):
+    """Seq from an opaque cursor, or from a plain ?before_seq=/?after_seq= number"""
+    if cursor:
+        return decode_cursor(cursor)
+    if seq in (None, ''):
+        return None
+    try:
+        return int(seq)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid seq: {seq}") from e
+
+
+def get_page_size(value, default=None, maximum=None):
+    """Clamp a requested page size to the configured bounds"""
+    if default is None:
+        default = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+    if maximum is None:
+        maximum = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+    try:
+        size = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def paginate_messages(queryset, before=None, after=None, limit=None):
+    """Keyset-paginate one room's Chat queryset on seq.
+
+    ``before`` and ``after`` are seq numbers (see message_position). Without
+    either the newest page is returned; ``before`` walks towards older
+    messages and ``after`` towards newer ones, so after=n with limit=k is
+    exactly the range n+1..n+k. Messages are always returned oldest first.
+    """
+    limit = get_page_size(limit)
+
+    if after is not None:
+        rows = list(queryset.filter(seq__gt=after).order_by('seq')[:limit + 1])
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+        return {
+            'messages': messages,
+            # Seqs start at 1 with no gaps, so a message past ``after`` means 1..after exist
+            'has_more_before': after > 0 and (bool(messages) or queryset.filter(seq__lte=after).exists()),
+            'has_more_after': has_more,
+        }
+
+    if before is not None:
+        queryset = queryset.filter(seq__lt=before)
+
+    rows = list(queryset.order_by('-seq')[:limit + 1])
+    has_more = len(rows) > limit
+    messages = rows[:limit][::-1]
+    return {
+        'messages': messages,
+        'has_more_before': has_more,
+        'has_more_after': before is not None,
+    }
+
+
+def page_cursors(messages):
+    """Cursors pointing just before the oldest and just after the newest message"""
+    if not messages:
+        return None, None
+    return encode_cursor(messages[0]), encode_cursor(messages[-1])
+
+
+def paginate_users(queryset, search=None, after=None, limit=None):
+    """Keyset-paginate users on (lower(username), id), optionally by username or email prefix.
+
+    The ordering and the keyset range use the (lower(username), id) index
+    from migration 0018. On Postgres the prefix filters use the
+    varchar_pattern_ops indexes on lower(username) (0012) and lower(email)
+    (0018).
+    """
+    limit = get_page_size(
+        limit,
+        default=getattr(settings, 'USER_DIRECTORY_PAGE_SIZE', 50),
+        maximum=getattr(settings, 'USER_DIRECTORY_MAX_PAGE_SIZE', 200),
+    )
+    queryset = queryset.annotate(username_lower=Lower('username'))
+
+    if search:
+        prefix = search.strip().lower()
+        queryset = queryset.alias(email_lower=Lower('email')).filter(
+            Q(username_lower__startswith=prefix) | Q(email_lower__startswith=prefix)
+        )
+
+    if after:
+        username_lower, user_id = decode_values(after, 2)
+        try:
+            user_id = int(user_id)
+        except ValueError as e:
+            raise InvalidCursor(f"Invalid cursor: {after}") from e
+        # (username_lower, id) > cursor, written as a range the index can start from
+        queryset = queryset.filter(username_lower__gte=username_lower).exclude(
+            username_lower=username_lower, id__lte=user_id
+        )
+
+    rows = list(queryset.order_by('username_lower', 'id')[:limit + 1])
+    users = rows[:limit]
+    has_more = len(rows) > limit
+    return {
+        'users': users,
+        'has_more': has_more,
+        'next_cursor': encode_values(users[-1].username_lower, users[-1].id) if has_more else None,
+    }
+
@@ -0,0 +1,84 @@
+"""
+Password hashing on a bounded pool of threads.
+
+A PBKDF2 or Argon2 call is tens of milliseconds of CPU. Run inline, a burst
+of logins or registrations occupies every thread the ASGI server runs sync
+views on, and they all compete for the same cores. Here at most
+PASSWORD_HASH_WORKERS hashes run at once per process. Both hashers release
+the GIL, so those threads really do run in parallel. Other callers queue,
+and give up with PasswordHashBusy after PASSWORD_HASH_TIMEOUT seconds.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+from chat.metrics import password_hash_queue_seconds, password_hash_seconds
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PasswordHashBusy(Exception):
+    """No hashing thread came free within PASSWORD_HASH_TIMEOUT"""
+
+
+def get_hash_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 2),
+                thread_name_prefix='chat-hash',
+            )
+        return _executor
+
+
+def _run(operation, func, *args):
+    submitted = time.perf_counter()
+    timer = password_hash_seconds.labels(operation)
+
+    def timed():
+        password_hash_queue_seconds.observe(time.perf_counter() - submitted)
+        with timer.time():
+            return func(*args)
+
+    future = get_hash_executor().submit(timed)
+    try:
+        return future.result(timeout=getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5))
+    except FutureTimeoutError as e:
+        future.cancel()
+        raise PasswordHashBusy() from e
+
+
+def _verify(raw_password, encoded):
+    """(matches, new hash if ``encoded`` was made by an outdated hasher)"""
+    upgraded = []
+    matches = check_password(raw_password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return matches, upgraded[0] if upgraded else None
+
+
+def hash_password(raw_password):
+    """make_password() on the hashing pool"""
+    return _run('make', make_password, raw_password)
+
+
+def verify_password(user, raw_password):
+    """Check ``raw_password`` for ``user``, or for nobody when ``user`` is None.
+
+    Unknown users still cost one hash, as with ModelBackend, so response
+    times don't reveal which emails are registered. An outdated stored
+    hash is replaced once the password has been confirmed.
+    """
+    if user is None:
+        _run('make', make_password, raw_password)
+        return False
+
+    matches, upgraded = _run('verify', _verify, raw_password, user.password)
+    if upgraded:
+        user.password = upgraded
+        user.save(update_fields=['password'])
+    return matches
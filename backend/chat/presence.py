@@ -0,0 +1,338 @@
+"""
+Presence tracking for WebSocket connections.
+
+Connection counts live in a PresenceStore (Redis in production, an
+in-process dict in tests and single-process development) instead of the
+database. Each tab of a user holds one reference; a closed tab releases its
+reference only after PRESENCE_OFFLINE_GRACE_SECONDS, so a quick reconnect
+never shows the user offline. Online/offline transitions are written to
+UserStatus in batches every PRESENCE_FLUSH_INTERVAL_SECONDS.
+
+A process that is killed never writes its users' offline transitions, so
+each PresenceService reconciles UserStatus with the store on its first
+flush and whenever the heartbeat finds another process's liveness key
+expired.
+Then users still marked online with no connection anywhere are set offline.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+import weakref
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from chat.db import database_sync_to_async
+from chat.models import UserStatus
+
+logger = logging.getLogger(__name__)
+
+
+class LocalPresenceStore:
+    """In-process store, for tests and single-process development"""
+
+    def __init__(self, **options):
+        self.connections = {}
+        self.last_seen = {}
+
+    async def incr(self, user_id):
+        count = self.connections.get(user_id, 0) + 1
+        self.connections[user_id] = count
+        return count
+
+    async def decr(self, user_id):
+        count = self.connections.get(user_id, 0) - 1
+        if count > 0:
+            self.connections[user_id] = count
+        else:
+            self.connections.pop(user_id, None)
+        return max(count, 0)
+
+    async def count(self, user_id):
+        return self.connections.get(user_id, 0)
+
+    async def connected(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self.connections}
+
+    async def set_last_seen(self, user_id, when):
+        self.last_seen[user_id] = when
+
+    async def heartbeat(self):
+        return []
+
+    def snapshot(self, user_ids):
+        result = {}
+        for user_id in user_ids:
+            if user_id in self.connections:
+                result[user_id] = {'is_online': True, 'last_seen': None}
+            elif user_id in self.last_seen:
+                result[user_id] = {'is_online': False, 'last_seen': self.last_seen[user_id]}
+        return result
+
+
+class RedisPresenceStore:
+    """Presence in the channel-layer Redis.
+
+    Every server process keeps its connection counts in its own hash,
+    ``presence:instance:<id>``, and proves it is alive with a separate
+    ``presence:alive:<id>`` key. heartbeat() refreshes the TTL of both. A
+    process that dies without running its disconnects lets both expire, so
+    users it served do not stay online forever. The counts hash alone can't
+    show liveness: Redis deletes it when an idle process's last user leaves.
+    A user's count is the sum over the live instance hashes.
+    """
+    INSTANCES_KEY = 'presence:instances'
+    LAST_SEEN_KEY = 'presence:last_seen'
+
+    def __init__(self, host='localhost', port=6379, db=0, ttl=60, **options):
+        import redis
+
+        self.connection_kwargs = {'host': host, 'port': port, 'db': db}
+        self.ttl = ttl
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.key = f'presence:instance:{self.instance_id}'
+        self.alive_key = f'presence:alive:{self.instance_id}'
+        self.sync_client = redis.Redis(**self.connection_kwargs)
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        # redis.asyncio connections are bound to the loop that opened them
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = redis.asyncio.Redis(**self.connection_kwargs)
+        return client
+
+    async def incr(self, user_id):
+        pipe = self.client().pipeline()
+        pipe.hincrby(self.key, user_id, 1)
+        pipe.expire(self.key, self.ttl)
+        pipe.set(self.alive_key, 1, ex=self.ttl)
+        pipe.sadd(self.INSTANCES_KEY, self.instance_id)
+        await pipe.execute()
+        return await self.count(user_id)
+
+    async def decr(self, user_id):
+        client = self.client()
+        # Only this process writes its own hash, so no cross-process race here
+        if await client.hincrby(self.key, user_id, -1) <= 0:
+            await client.hdel(self.key, user_id)
+        return await self.count(user_id)
+
+    async def count(self, user_id):
+        client = self.client()
+        instances = await client.smembers(self.INSTANCES_KEY)
+        if not instances:
+            return 0
+        pipe = client.pipeline()
+        for instance in instances:
+            pipe.hget(f'presence:instance:{instance.decode()}', user_id)
+        return sum(int(value) for value in await pipe.execute() if value)
+
+    async def connected(self, user_ids):
+        """The subset of ``user_ids`` with a connection on a live instance"""
+        user_ids = list(user_ids)
+        client = self.client()
+        instances = await client.smembers(self.INSTANCES_KEY)
+        if not user_ids or not instances:
+            return set()
+        pipe = client.pipeline()
+        for instance in instances:
+            pipe.hmget(f'presence:instance:{instance.decode()}', user_ids)
+        rows = await pipe.execute()
+        return {
+            user_id for index, user_id in enumerate(user_ids)
+            if any(row[index] and int(row[index]) > 0 for row in rows)
+        }
+
+    async def set_last_seen(self, user_id, when):
+        await self.client().hset(self.LAST_SEEN_KEY, user_id, when.isoformat())
+
+    async def heartbeat(self):
+        """Refresh this instance's TTL; returns the instances found dead"""
+        client = self.client()
+        pipe = client.pipeline()
+        pipe.expire(self.key, self.ttl)
+        pipe.set(self.alive_key, 1, ex=self.ttl)
+        pipe.sadd(self.INSTANCES_KEY, self.instance_id)
+        await pipe.execute()
+
+        # Forget instances whose liveness key has expired, with any counts left
+        instances = list(await client.smembers(self.INSTANCES_KEY))
+        pipe = client.pipeline()
+        for instance in instances:
+            pipe.exists(f'presence:alive:{instance.decode()}')
+        dead = [instance for instance, alive in zip(instances, await pipe.execute()) if not alive]
+        if dead:
+            pipe = client.pipeline()
+            pipe.srem(self.INSTANCES_KEY, *dead)
+            pipe.delete(*[f'presence:instance:{instance.decode()}' for instance in dead])
+            await pipe.execute()
+        return dead
+
+    def snapshot(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+
+        instances = self.sync_client.smembers(self.INSTANCES_KEY)
+        pipe = self.sync_client.pipeline()
+        for instance in instances:
+            pipe.hmget(f'presence:instance:{instance.decode()}', user_ids)
+        pipe.hmget(self.LAST_SEEN_KEY, user_ids)
+        *counts, last_seen = pipe.execute()
+
+        result = {}
+        for index, user_id in enumerate(user_ids):
+            if any(row[index] and int(row[index]) > 0 for row in counts):
+                result[user_id] = {'is_online': True, 'last_seen': None}
+            elif last_seen[index]:
+                result[user_id] = {
+                    'is_online': False,
+                    'last_seen': datetime.fromisoformat(last_seen[index].decode()),
+                }
+        return result
+
+
+def flush_statuses(updates):
+    """Write {user_id: (is_online, last_seen)} to UserStatus in one transaction"""
+    with transaction.atomic():
+        statuses = list(UserStatus.objects.filter(user_id__in=updates))
+        for user_status in statuses:
+            user_status.is_online, user_status.last_seen = updates[user_status.user_id]
+        UserStatus.objects.bulk_update(statuses, ['is_online', 'last_seen'])
+
+        existing = {user_status.user_id for user_status in statuses}
+        UserStatus.objects.bulk_create([
+            UserStatus(user_id=user_id, is_online=is_online, last_seen=last_seen)
+            for user_id, (is_online, last_seen) in updates.items()
+            if user_id not in existing
+        ], ignore_conflicts=True)
+
+
+def online_user_ids():
+    return list(UserStatus.objects.filter(is_online=True).values_list('user_id', flat=True))
+
+
+class PresenceService:
+    """Per event loop front end of the store used by ChatConsumer"""
+
+    def __init__(self, store, grace, flush_interval):
+        self.store = store
+        self.grace = grace
+        self.flush_interval = flush_interval
+        self.dirty = {}
+        self.release_tasks = set()
+        self.flush_task = None
+        self.reconciled = False
+
+    async def user_connected(self, user_id):
+        self.ensure_flusher()
+        if await self.store.incr(user_id) == 1:
+            self.dirty[user_id] = (True, None)
+
+    async def user_disconnected(self, user_id):
+        # Hold the reference for the grace period so a flapping connection
+        # never reaches zero and causes no writes at all
+        task = asyncio.ensure_future(self.release(user_id))
+        self.release_tasks.add(task)
+        task.add_done_callback(self.release_tasks.discard)
+
+    async def release(self, user_id):
+        await asyncio.sleep(self.grace)
+        try:
+            if await self.store.decr(user_id) == 0:
+                now = timezone.now()
+                await self.store.set_last_seen(user_id, now)
+                self.dirty[user_id] = (False, now)
+        except Exception as e:
+            logger.error("Error releasing presence for user %s: %s", user_id, e)
+
+    def ensure_flusher(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.ensure_future(self.run_flusher())
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """Run pending releases, stop the flusher and write what is left"""
+        if self.release_tasks:
+            await asyncio.gather(*self.release_tasks, return_exceptions=True)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        try:
+            dead = await self.store.heartbeat()
+            if dead or not self.reconciled:
+                await self.reconcile()
+        except Exception as e:
+            logger.error("Presence heartbeat failed: %s", e)
+
+        if not self.dirty:
+            return
+        updates, self.dirty = self.dirty, {}
+        try:
+            await database_sync_to_async(flush_statuses)(updates)
+        except Exception as e:
+            logger.error("Error flushing %s user statuses: %s", len(updates), e)
+            # Keep the updates for the next round unless newer ones arrived
+            for user_id, update in updates.items():
+                self.dirty.setdefault(user_id, update)
+
+
+    async def reconcile(self):
+        """Queue offline updates for users UserStatus shows online but no live process holds"""
+        online = await database_sync_to_async(online_user_ids)()
+        connected = await self.store.connected(online)
+        now = timezone.now()
+        for user_id in online:
+            if user_id not in connected and user_id not in self.dirty:
+                await self.store.set_last_seen(user_id, now)
+                self.dirty[user_id] = (False, now)
+        self.reconciled = True
+
+
+_stores = {}
+_services = weakref.WeakKeyDictionary()
+
+
+def get_presence_store():
+    backend = getattr(settings, 'PRESENCE_BACKEND', 'chat.presence.LocalPresenceStore')
+    store = _stores.get(backend)
+    if store is None:
+        store = _stores[backend] = import_string(backend)(**getattr(settings, 'PRESENCE_OPTIONS', {}))
+    return store
+
+
+def get_presence():
+    loop = asyncio.get_running_loop()
+    service = _services.get(loop)
+    if service is None or service.store is not get_presence_store():
+        service = _services[loop] = PresenceService(
+            get_presence_store(),
+            grace=getattr(settings, 'PRESENCE_OFFLINE_GRACE_SECONDS', 5),
+            flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL_SECONDS', 10),
+        )
+    return service
+
+
+def presence_snapshot(user_ids):
+    """{user_id: {'is_online', 'last_seen'}} for users the store knows about"""
+    try:
+        return get_presence_store().snapshot(user_ids)
+    except Exception as e:
+        logger.warning("Presence store unavailable, falling back to UserStatus: %s", e)
+        return {}
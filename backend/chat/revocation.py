@@ -0,0 +1,123 @@
+"""
+Revoked JWTs, checked on every WebSocket handshake and token refresh.
+
+Logout records the ``jti`` of the user's refresh and access tokens in a
+RevocationStore (Redis in production, an in-process dict in tests and
+single-process development). Each entry lasts until the token would have
+expired anyway, then disappears on its own. A check is a single key lookup
+with no database query, so it runs on every handshake, including those the
+middleware answers from its token cache.
+
+An unreachable store is logged and treated as "not revoked" rather than
+locking every user out.
+"""
+import asyncio
+import logging
+import math
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from chat.metrics import token_revocation_checks
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRevocationStore:
+    """In-process store, for tests and single-process development"""
+
+    def __init__(self, **options):
+        self.revoked = {}
+
+    def revoke(self, jti, exp):
+        now = time.time()
+        self.revoked = {key: until for key, until in self.revoked.items() if until > now}
+        if exp > now:
+            self.revoked[jti] = exp
+
+    def is_revoked(self, jti):
+        return self.revoked.get(jti, 0) > time.time()
+
+    async def ais_revoked(self, jti):
+        return self.is_revoked(jti)
+
+
+class RedisRevocationStore:
+    """One ``revoked:<jti>`` key per token, expiring with the token"""
+    PREFIX = 'revoked:'
+
+    def __init__(self, host='localhost', port=6379, db=0, **options):
+        import redis
+
+        self.connection_kwargs = {'host': host, 'port': port, 'db': db}
+        self.sync_client = redis.Redis(**self.connection_kwargs)
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        # redis.asyncio connections are bound to the loop that opened them
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = redis.asyncio.Redis(**self.connection_kwargs)
+        return client
+
+    def revoke(self, jti, exp):
+        ttl = math.ceil(exp - time.time())
+        if ttl > 0:
+            self.sync_client.set(self.PREFIX + jti, 1, ex=ttl)
+
+    def is_revoked(self, jti):
+        return bool(self.sync_client.exists(self.PREFIX + jti))
+
+    async def ais_revoked(self, jti):
+        return bool(await self.client().exists(self.PREFIX + jti))
+
+
+_stores = {}
+
+
+def get_revocation_store():
+    backend = getattr(settings, 'TOKEN_REVOCATION_BACKEND', 'chat.revocation.LocalRevocationStore')
+    store = _stores.get(backend)
+    if store is None:
+        store = _stores[backend] = import_string(backend)(**getattr(settings, 'TOKEN_REVOCATION_OPTIONS', {}))
+    return store
+
+
+def revoke_token(token):
+    """Revoke a decoded simplejwt token until its ``exp``"""
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    if jti:
+        get_revocation_store().revoke(jti, token['exp'])
+
+
+def _checked(result):
+    token_revocation_checks.labels('revoked' if result else 'valid').inc()
+    return result
+
+
+def is_revoked(jti):
+    if not jti:
+        return False
+    try:
+        return _checked(get_revocation_store().is_revoked(jti))
+    except Exception as e:
+        token_revocation_checks.labels('error').inc()
+        logger.warning("Revocation store unavailable, accepting token: %s", e)
+        return False
+
+
+async def ais_revoked(jti):
+    if not jti:
+        return False
+    try:
+        return _checked(await get_revocation_store().ais_revoked(jti))
+    except Exception as e:
+        token_revocation_checks.labels('error').inc()
+        logger.warning("Revocation store unavailable, accepting token: %s", e)
+        return False
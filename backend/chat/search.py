@@ -0,0 +1,85 @@
+"""
+Full-text search over Chat.content, limited to the requester's rooms.
+
+Postgres matches to_tsvector(SEARCH_CONFIG, content) against a websearch
+query, served by the GIN expression index from migration 0015, and ranks
+with ts_rank. SQLite matches the FTS5 table from the same migration and
+ranks with bm25. Both indexes follow writes on their own, the expression
+index natively and the FTS table through triggers, so a message is
+searchable as soon as ChatConsumer.create_message commits it, whether it
+was saved on its own or group-committed with bulk_create.
+
+Only matching rows are read and ranked; pages are keyset-paginated on
+(score, id), best match first.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from chat.models import Chat
+from chat.pagination import InvalidCursor, decode_values, encode_values, get_page_size
+
+# Postgres text search configuration; migration 0015 indexes the same one
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'chat_chat_fts'
+
+
+def fts5_query(text):
+    """Quote every word so user input is never parsed as FTS5 syntax"""
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', text))
+
+
+def matching_messages(queryset, text):
+    """Narrow a Chat queryset to messages matching ``text``, annotated with ``score``"""
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector('content', config=SEARCH_CONFIG)
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        # ts_rank is a real; widen it so the score round-trips through the cursor exactly
+        return queryset.alias(document=vector).filter(document=query)\
+            .annotate(score=Cast(SearchRank(vector, query), FloatField()))
+
+    match = fts5_query(text)
+    if not match:
+        return queryset.annotate(score=Value(0.0, output_field=FloatField())).none()
+    fts = connection.ops.quote_name(FTS_TABLE)
+    chat = connection.ops.quote_name(Chat._meta.db_table)
+    return queryset.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [match])
+    ).annotate(score=RawSQL(
+        f'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {chat}.id',
+        [match],
+        output_field=FloatField(),
+    ))
+
+
+def search_messages(user, text, after=None, limit=None):
+    """One page of ``user``'s messages matching ``text``, best match first"""
+    limit = get_page_size(
+        limit,
+        default=getattr(settings, 'CHAT_SEARCH_PAGE_SIZE', 20),
+        maximum=getattr(settings, 'CHAT_SEARCH_MAX_PAGE_SIZE', 100),
+    )
+    queryset = matching_messages(Chat.objects.filter(chatroom__participants=user), text)
+
+    if after:
+        score, message_id = decode_values(after, 2)
+        try:
+            score, message_id = float(score), int(message_id)
+        except ValueError as e:
+            raise InvalidCursor(f"Invalid cursor: {after}") from e
+        queryset = queryset.filter(Q(score__lt=score) | Q(score=score, id__lt=message_id))
+
+    rows = list(queryset.select_related('sender', 'receiver').order_by('-score', '-id')[:limit + 1])
+    messages = rows[:limit]
+    has_more = len(rows) > limit
+    return {
+        'messages': messages,
+        'has_more': has_more,
+        'next_cursor': encode_values(messages[-1].score, messages[-1].id) if has_more else None,
+    }
@@ -1,12 +1,21 @@
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, update_last_login
 from rest_framework import serializers
-from chat.models import Chat,UserStatus,ChatRoom
+from chat.models import Chat,UserStatus,ChatRoom,InboxState
 import re
-from django.contrib.auth import authenticate
-from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from django.conf import settings
+from django.db.models.functions import Lower
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from django.core.validators import validate_email as django_validate_email
 from django.core.exceptions import ValidationError as DjangoValidationError
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from chat.passwords import hash_password, verify_password
+from chat.revocation import is_revoked, revoke_token
+
+
+def users_with_email(email):
+    """Case-insensitive email match on lower(email), served by auth_user_email_lower_idx"""
+    return User.objects.alias(email_lower=Lower('email')).filter(email_lower=email.strip().lower())
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -108,7 +117,7 @@ class UserSerializer(serializers.ModelSerializer):
         if not email_pattern.match(cleaned_value):
             raise serializers.ValidationError('Enter a valid email address')
         
-        if User.objects.filter(email__iexact=cleaned_value).exists():
+        if users_with_email(cleaned_value).exists():
             raise serializers.ValidationError("A user with this email already exists")
         
         return cleaned_value
@@ -131,12 +140,13 @@ class UserSerializer(serializers.ModelSerializer):
         # Remove confirm_password from validated_data as it's not needed for user creation
         validated_data.pop('confirm_password', None)
         
-        # Create user with hashed password
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password']
+        # Create user with hashed password, hashed on the bounded pool
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data['email']),
+            password=hash_password(validated_data['password']),
         )
+        user.save()
     
         return user
     
@@ -165,54 +175,54 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         if not email or not password:
             raise AuthenticationFailed('Email and password are required')
         
-        try:
-            # Find the user by email
-            user_obj = User.objects.get(email__iexact=email.strip())
-            logger.info(f"Found user: {user_obj.username}, active: {user_obj.is_active}")
-            
-            # Check if user is active first
-            if not user_obj.is_active:
-                raise AuthenticationFailed('Your account is not active. Please verify your email.')
-            
-            # Authenticate using the actual username
-            user = authenticate(
-                request=self.context.get('request'),
-                username=user_obj.username,  # Use actual username, not email
-                password=password
-            )
-            
-            if not user:
-                logger.warning(f"Authentication failed for email: {email}")
-                raise AuthenticationFailed('Invalid email or password')
-            
-            # IMPORTANT: Set username for parent class validation
-            attrs['username'] = user_obj.username
-            # Remove email since parent class doesn't expect it
-            attrs.pop('email', None)
-            
-            logger.info(f"Authentication successful for: {email}")
-            
-        except User.DoesNotExist:
+        # One indexed lookup and one hash; authenticate() and the parent
+        # validate() would each look the user up and verify again
+        user = users_with_email(email).order_by('id').first()
+        if user is None:
             logger.warning(f"User not found with email: {email}")
+        elif not user.is_active:
+            raise AuthenticationFailed('Your account is not active. Please verify your email.')
+
+        if not verify_password(user, password):
+            logger.warning(f"Authentication failed for email: {email}")
             raise AuthenticationFailed('Invalid email or password')
-        except AuthenticationFailed:
-            # Re-raise authentication errors
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error in serializer: {str(e)}")
-            raise AuthenticationFailed('Authentication failed')
-        
-        # Now call parent validate with username in attrs
-        return super().validate(attrs)
 
+        logger.info(f"Authentication successful for: {email}")
+        self.user = user
+        refresh = self.get_token(user)
+        if jwt_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """TokenRefreshSerializer that refuses tokens revoked in chat.revocation.
+
+    Bad, expired and revoked tokens all fail validation (rather than
+    raising), so the view answers them with a 401.
+    """
+
+    def validate(self, attrs):
+        try:
+            refresh = self.token_class(attrs['refresh'])
+        except TokenError as e:
+            raise serializers.ValidationError({'refresh': str(e)})
+        if is_revoked(refresh.get(jwt_settings.JTI_CLAIM)):
+            raise serializers.ValidationError({'refresh': 'Token has been revoked'})
+
+        data = super().validate(attrs)
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            revoke_token(refresh)
+        return data
                     
 class ChatSerializer(serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
-    receiver_username = serializers.CharField(source='receiver.username', read_only=True)
+    receiver_username = serializers.CharField(source='receiver.username', read_only=True, allow_null=True)
 
     class Meta:
         model = Chat
-        fields = ['id', 'sender_id', 'sender_username', 'receiver_id', 'receiver_username',
+        fields = ['id', 'seq', 'sender_id', 'sender_username', 'receiver_id', 'receiver_username',
                 'content', 'timestamp', 'is_read']
         
     def validate_content(self, value):
@@ -267,49 +277,79 @@ class ChatSerializer(serializers.ModelSerializer):
         return attrs
                 
                 
-class ChatRoomSerializer(serializers.ModelSerializer):
+class GroupRoomSerializer(serializers.ModelSerializer):
+    """A group room; member_ids are the users to add besides the requester"""
+    member_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), write_only=True, default=list)
+    participant_ids = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatRoom
+        fields = ['id', 'name', 'is_group', 'member_ids', 'participant_ids', 'created_at']
+        read_only_fields = ['is_group', 'created_at']
+
+    def get_participant_ids(self, obj):
+        return sorted(user.id for user in obj.participants.all())
+
+    def validate_name(self, value):
+        if not value or not value.strip():
+            raise serializers.ValidationError('Group name cannot be blank')
+        return value.strip()
+
+    def validate_member_ids(self, value):
+        # The requester is added on top of these
+        return validate_group_members(value, extra=1)
+
+
+def validate_group_members(user_ids, extra=0):
+    """Distinct existing user ids, at most CHAT_GROUP_MAX_MEMBERS counting ``extra`` more"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) + extra > getattr(settings, 'CHAT_GROUP_MAX_MEMBERS', 256):
+        raise serializers.ValidationError('Too many members for one group')
+    found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        raise serializers.ValidationError(f'Unknown user ids: {missing}')
+    return user_ids
+
+
+class MessageSearchSerializer(ChatSerializer):
+    """A search hit: the message and the room it was found in"""
+
+    class Meta(ChatSerializer.Meta):
+        fields = ChatSerializer.Meta.fields + ['chatroom_id']
+
+
+class InboxStateSerializer(serializers.ModelSerializer):
+    """One conversation in the room list, read from the maintained InboxState row"""
+    id = serializers.IntegerField(source='room_id', read_only=True)
+    is_group = serializers.BooleanField(source='room.is_group', read_only=True)
+    name = serializers.CharField(source='room.name', read_only=True)
     other_user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
     last_message_time = serializers.SerializerMethodField()
-    unread_count = serializers.SerializerMethodField()
 
     class Meta:
-        model = ChatRoom
-        fields = ['id', 'other_user', 'last_message', 'last_message_time', 'unread_count']
+        model = InboxState
+        fields = ['id', 'is_group', 'name', 'other_user', 'last_message', 'last_message_time', 'unread_count']
 
     def get_other_user(self, obj):
-        request = self.context.get("request")
-        if request and hasattr(request, 'user'):
-            other_users = [user for user in obj.participants.all() if user != request.user]
-            return UserSerializer(other_users, many=True).data
-        return []
+        other_users = [user for user in obj.room.participants.all() if user.id != obj.user_id]
+        return UserSerializer(other_users, many=True).data
 
     def get_last_message(self, obj):
-        last_message = Chat.objects.filter(chatroom=obj).order_by("-timestamp").first()
+        last_message = obj.last_message
         if last_message:
             return {
                 'id': last_message.id,
                 'content': last_message.content,
-                'sender_id': last_message.sender.id,
+                'sender_id': last_message.sender_id,
                 'sender_username': last_message.sender.username,
                 'timestamp': last_message.timestamp
             }
         return None
 
     def get_last_message_time(self, obj):
-        last_message = Chat.objects.filter(chatroom=obj).order_by("-timestamp").first()
-        return last_message.timestamp if last_message else None
-
-    def get_unread_count(self, obj):
-        request = self.context.get("request")
-        if request and hasattr(request, 'user'):
-            unread_count = Chat.objects.filter(
-                chatroom=obj,
-                receiver=request.user,
-                is_read=False
-            ).count()
-            return unread_count
-        return 0
+        return obj.last_message.timestamp if obj.last_message else None
 
 
 class UserStatusSerializer(serializers.ModelSerializer):
@@ -318,8 +358,22 @@ class UserStatusSerializer(serializers.ModelSerializer):
         fields = ['is_online', 'last_seen']
 
 class UserListSerializer(serializers.ModelSerializer):
-    status = UserStatusSerializer(read_only=True)
+    """Status comes from the presence snapshot in context, else from UserStatus"""
+    status = serializers.SerializerMethodField()
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'status']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'status']
+
+    def get_status(self, obj):
+        presence = self.context.get('presence', {}).get(obj.id)
+        if presence is not None:
+            last_seen = presence['last_seen']
+            return {
+                'is_online': presence['is_online'],
+                'last_seen': serializers.DateTimeField().to_representation(last_seen) if last_seen else None,
+            }
+        try:
+            return UserStatusSerializer(obj.status).data
+        except UserStatus.DoesNotExist:
+            return None
\ No newline at end of file
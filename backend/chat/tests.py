@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import runpy
+import threading
+import time
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from chat import codec
+from chat.batching import MessageBatchWriter
+from chat.consumers import ChatConsumer
+from chat.logutils import HotPathLogger
+from chat.loadtest import LOAD_TEST_SETTINGS, run_load_test
+from chat.middleware import JWTAuthMiddleware, TokenUserCache, resolve_user, token_user_cache
+from chat.db import database_sync_to_async, get_db_executor
+from chat.models import Chat, ChatRoom, InboxState, UserStatus
+from chat.outbound import OutboundQueue
+from chat.presence import LocalPresenceStore, PresenceService, get_presence
+from chat.routing import websocket_urlpatterns
+from chat.typing_indicators import TypingThrottle
+
+
+class ConversationListViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, room, sender, receiver, content):
+        message = Chat.objects.create(chatroom=room, sender=sender, receiver=receiver, content=content)
+        InboxState.record_message(message)
+        return message
+
+    def create_conversations(self, count, start=0):
+        for i in range(start, start + count):
+            other = User.objects.create_user(username=f'peer{i}', email=f'peer{i}@example.com')
+            room = ChatRoom.get_or_create_room(self.user, other)
+            self.send(room, other, self.user, f'hi {i}')
+            self.send(room, self.user, other, f'reply {i}')
+            self.send(room, other, self.user, f'last {i}')
+
+    def test_query_count_is_constant(self):
+        self.create_conversations(3)
+        with self.assertNumQueries(2):
+            self.client.get('/chat/conversations/')
+
+        self.create_conversations(27, start=3)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/chat/conversations/')
+        self.assertEqual(len(response.data), 30)
+
+    def test_last_message_and_unread_count(self):
+        self.create_conversations(1)
+        response = self.client.get('/chat/conversations/')
+
+        conversation = response.data[0]
+        self.assertEqual(conversation['last_message']['content'], 'last 0')
+        self.assertEqual(conversation['last_message']['sender_username'], 'peer0')
+        self.assertEqual(conversation['unread_count'], 2)
+        self.assertEqual([u['username'] for u in conversation['other_user']], ['peer0'])
+
+    def test_ordered_by_last_activity(self):
+        self.create_conversations(3)
+        first_room = ChatRoom.get_or_create_room(self.user, User.objects.get(username='peer0'))
+        self.send(first_room, self.user, first_room.participants.exclude(id=self.user.id).get(), 'bump')
+
+        response = self.client.get('/chat/conversations/')
+
+        self.assertEqual(response.data[0]['id'], first_room.id)
+        self.assertEqual(response.data[0]['last_message']['content'], 'bump')
+        first_room.refresh_from_db()
+        self.assertEqual(first_room.updated_at, response.data[0]['last_message_time'])
+
+    def test_reads_take_messages_off_the_unread_counter(self):
+        self.create_conversations(1)
+        room = ChatRoom.objects.get()
+
+        InboxState.record_read(room.id, self.user.id)
+        self.assertEqual(InboxState.objects.get(room=room, user=self.user).unread_count, 1)
+        # Never below zero, whatever a client reports
+        InboxState.record_read(room.id, self.user.id, count=5)
+        self.assertEqual(InboxState.objects.get(room=room, user=self.user).unread_count, 0)
+        self.assertEqual(InboxState.objects.exclude(user=self.user).get().unread_count, 1)
+
+    def test_backfill_rebuilds_the_maintained_rows(self):
+        self.create_conversations(3)
+        Chat.objects.filter(receiver=self.user, content='hi 1').update(is_read=True)
+        InboxState.record_read(ChatRoom.objects.get(participants__username='peer1').id, self.user.id)
+        fields = ('room_id', 'user_id', 'last_message_id', 'last_activity', 'unread_count')
+        maintained = sorted(InboxState.objects.values_list(*fields))
+
+        InboxState.objects.all().delete()
+        import_module('chat.migrations.0011_inboxstate').backfill_inbox_states(apps, None)
+
+        self.assertEqual(sorted(InboxState.objects.values_list(*fields)), maintained)
+        self.assertEqual(len(maintained), 6)
+
+
+class ChatRoomTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+
+    def test_either_order_finds_the_same_room(self):
+        room = ChatRoom.get_or_create_room(self.alice, self.bob)
+
+        self.assertEqual(ChatRoom.get_or_create_room(self.bob, self.alice), room)
+        self.assertEqual(ChatRoom.objects.count(), 1)
+        self.assertEqual(sorted(room.participants.values_list('id', flat=True)), [self.alice.id, self.bob.id])
+        self.assertEqual(InboxState.objects.filter(room=room).count(), 2)
+
+    def test_losing_a_create_race_returns_the_winners_room(self):
+        room = ChatRoom.get_or_create_room(self.alice, self.bob)
+
+        # The probe misses, as it would before the concurrent insert committed
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            self.assertEqual(ChatRoom.get_or_create_room(self.bob, self.alice), room)
+        self.assertEqual(ChatRoom.objects.count(), 1)
+
+    def test_connection_resolves_each_receiver_once(self):
+        carol = User.objects.create_user(username='carol', email='carol@example.com')
+        room = ChatRoom.get_or_create_room(self.alice, self.bob)
+        consumer = ChatConsumer()
+        consumer.user = self.alice
+        consumer.room_cache = {}
+
+        self.assertEqual(consumer.resolve_room(self.bob.id), (room.id, 'bob'))
+        with self.assertNumQueries(0):
+            self.assertEqual(consumer.resolve_room(self.bob.id), (room.id, 'bob'))
+        self.assertIsNone(consumer.resolve_room(0))
+
+        # A full cache drops its oldest receiver
+        with mock.patch('chat.consumers.ROOM_CACHE_SIZE', 1):
+            consumer.resolve_room(carol.id)
+        self.assertEqual(list(consumer.room_cache), [carol.id])
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com')
+        for username, email in [('Anna', 'anna@example.com'), ('andy', 'zed@example.com'),
+                                ('bert', 'and.bert@example.com'), ('Carl', 'carl@example.com'),
+                                ('anna', 'anna2@example.com')]:
+            User.objects.create_user(username=username, email=email)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def usernames(self, response):
+        return [user['username'] for user in response.data['data']]
+
+    def test_pages_follow_the_cursor_without_overlap(self):
+        first = self.client.get('/chat/users/', {'limit': 2})
+        self.assertEqual(self.usernames(first), ['andy', 'Anna'])
+        self.assertTrue(first.data['has_more'])
+
+        second = self.client.get('/chat/users/', {'limit': 2, 'after': first.data['next_cursor']})
+        self.assertEqual(self.usernames(second), ['anna', 'bert'])
+
+        last = self.client.get('/chat/users/', {'limit': 2, 'after': second.data['next_cursor']})
+        self.assertEqual(self.usernames(last), ['Carl'])
+        self.assertFalse(last.data['has_more'])
+        self.assertIsNone(last.data['next_cursor'])
+
+    def test_search_matches_username_or_email_prefix(self):
+        response = self.client.get('/chat/users/', {'search': ' AN '})
+
+        self.assertEqual(self.usernames(response), ['andy', 'Anna', 'anna', 'bert'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/chat/users/', {'after': 'nonsense'}).status_code, 400)
+
+
+class ChatLoadTests(TestCase):
+    """Small runs of chat.loadtest; ``manage.py loadtest`` runs the full-size ones"""
+
+    def test_chat_messages_delivered_within_query_budget(self):
+        report = run_load_test(clients=2, operations=40, mix='chat')
+
+        stats = report['events']['chat_message']
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(stats['delivered'], stats['sent'])
+        # INSERT, two UPDATEs and the savepoint pair per message once the room is cached
+        self.assertLessEqual(report['queries_per_message'], 5.5)
+
+    def test_mixed_load_delivers_every_event(self):
+        report = run_load_test(clients=4, operations=15, mix='mixed', seed=1)
+
+        self.assertEqual(report['errors'], 0)
+        for kind, stats in report['events'].items():
+            self.assertEqual(stats['delivered'], stats['sent'], kind)
+        self.assertGreater(report['events']['read_up_to']['sent'], 0)
+
+
+class GroupCommitTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        self.alice_bob = ChatRoom.get_or_create_room(self.alice, self.bob)
+        self.alice_carol = ChatRoom.get_or_create_room(self.alice, self.carol)
+
+    def message(self, room, sender, receiver, content):
+        return Chat(chatroom_id=room.id if isinstance(room, ChatRoom) else room,
+                    sender=sender, receiver=receiver, content=content)
+
+    def submit(self, messages):
+        async def scenario():
+            writer = MessageBatchWriter(window=0.01, max_batch=50)
+            return await asyncio.gather(*(writer.submit(message) for message in messages), return_exceptions=True)
+
+        return async_to_sync(scenario)()
+
+    def test_batch_is_one_insert_with_seqs_and_inbox_counters(self):
+        with CaptureQueriesContext(connection) as queries:
+            saved = self.submit([
+                self.message(self.alice_bob, self.alice, self.bob, 'one'),
+                self.message(self.alice_carol, self.alice, self.carol, 'two'),
+                self.message(self.alice_bob, self.bob, self.alice, 'three'),
+            ])
+
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "chat_chat"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertTrue(all(message.id for message in saved))
+        self.assertEqual([message.seq for message in saved], [1, 1, 2])
+
+        unread = {(room_id, user_id): count for room_id, user_id, count in
+                  InboxState.objects.values_list('room_id', 'user_id', 'unread_count')}
+        self.assertEqual(unread, {
+            (self.alice_bob.id, self.alice.id): 1,
+            (self.alice_bob.id, self.bob.id): 1,
+            (self.alice_carol.id, self.alice.id): 0,
+            (self.alice_carol.id, self.carol.id): 1,
+        })
+        self.assertEqual(InboxState.objects.get(room=self.alice_bob, user=self.bob).last_message_id, saved[2].id)
+
+    def test_failed_row_only_fails_its_own_submitter(self):
+        results = self.submit([
+            self.message(self.alice_bob, self.alice, self.bob, 'one'),
+            self.message(self.alice_carol.id + 1000, self.alice, self.carol, 'no such room'),
+            self.message(self.alice_bob, self.alice, self.bob, 'two'),
+        ])
+
+        self.assertIsInstance(results[1], ChatRoom.DoesNotExist)
+        self.assertEqual([results[0].seq, results[2].seq], [1, 2])
+        self.assertEqual(list(Chat.objects.order_by('seq').values_list('content', flat=True)), ['one', 'two'])
+        self.assertEqual(InboxState.objects.get(room=self.alice_bob, user=self.bob).unread_count, 2)
+
+    @override_settings(**LOAD_TEST_SETTINGS, CHAT_GROUP_COMMIT_ENABLED=True)
+    def test_oversized_message_is_rejected_before_the_batch(self):
+        async def scenario():
+            application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+            alice = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(self.alice)}')
+            await alice.connect()
+            await alice.receive_json_from()
+            await alice.send_json_to({'type': 'chat_message', 'receiver_id': self.bob.id, 'content': 'x' * 2000})
+            error = await alice.receive_json_from()
+            await alice.send_json_to({'type': 'chat_message', 'receiver_id': self.bob.id, 'content': 'short'})
+            sent = await alice.receive_json_from()
+            await alice.disconnect()
+            await get_presence().close()
+            return error, sent
+
+        error, sent = async_to_sync(scenario)()
+
+        self.assertEqual(error, {'type': 'error', 'error': 'Message is longer than 1000 characters'})
+        self.assertEqual(sent['message']['content'], 'short')
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='gina', email='gina@example.com')
+
+    def run_presence(self, steps, grace=0):
+        async def scenario():
+            service = PresenceService(LocalPresenceStore(), grace=grace, flush_interval=60)
+            await steps(service)
+            await service.close()
+            return service
+
+        return async_to_sync(scenario)()
+
+    def is_online(self):
+        return UserStatus.objects.filter(user=self.user, is_online=True).exists()
+
+    def test_offline_only_when_the_last_connection_closes(self):
+        async def steps(service):
+            await service.user_connected(self.user.id)
+            await service.user_connected(self.user.id)
+            await service.user_disconnected(self.user.id)
+            await asyncio.gather(*service.release_tasks)
+            await service.flush()
+            self.assertEqual(await service.store.count(self.user.id), 1)
+            self.assertTrue(await database_sync_to_async(self.is_online)())
+            await service.user_disconnected(self.user.id)
+
+        self.run_presence(steps)
+
+        status = UserStatus.objects.get(user=self.user)
+        self.assertFalse(status.is_online)
+        self.assertIsNotNone(status.last_seen)
+
+    def test_reconnect_within_grace_never_goes_offline(self):
+        async def steps(service):
+            await service.user_connected(self.user.id)
+            await service.flush()
+            await service.user_disconnected(self.user.id)
+            await service.user_connected(self.user.id)
+            await asyncio.gather(*service.release_tasks)
+            self.assertEqual(service.dirty, {})
+
+        service = self.run_presence(steps, grace=0.01)
+
+        self.assertEqual(service.store.connections, {self.user.id: 1})
+        self.assertTrue(UserStatus.objects.get(user=self.user).is_online)
+
+    def test_first_flush_clears_users_left_online_by_a_dead_process(self):
+        UserStatus.objects.create(user=self.user, is_online=True)
+        other = User.objects.create_user(username='hal', email='hal@example.com')
+
+        async def steps(service):
+            await service.user_connected(other.id)
+
+        self.run_presence(steps)
+
+        self.assertFalse(UserStatus.objects.get(user=self.user).is_online)
+        self.assertTrue(UserStatus.objects.get(user=other).is_online)
+
+    def test_later_flushes_reconcile_only_when_a_process_died(self):
+        async def steps(service):
+            with mock.patch.object(service, 'reconcile', wraps=service.reconcile) as reconcile:
+                await service.flush()
+                await service.flush()
+                self.assertEqual(reconcile.call_count, 1)
+                with mock.patch.object(service.store, 'heartbeat', return_value=[b'gone']):
+                    await service.flush()
+                self.assertEqual(reconcile.call_count, 2)
+
+        self.run_presence(steps)
+
+
+class MetricsViewTests(TestCase):
+    def test_exposes_websocket_db_and_http_metrics(self):
+        run_load_test(clients=2, operations=5, mix='mixed')
+        User.objects.create_user(username='viewer', email='viewer@example.com')
+        self.client.get('/chat/conversations/')
+
+        response = self.client.get('/metrics/')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('chat_ws_connections ', body)
+        self.assertIn('chat_ws_event_seconds_bucket{', body)
+        self.assertNotIn('worker=', body)
+        self.assertIn('event="chat_message"', body)
+        self.assertIn('operation="ChatConsumer.save_message"', body)
+        self.assertIn('method="GET",route="chat/conversations/",status="4xx"', body)
+        self.assertIn('chat_typing_events_total', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class HotPathLoggerTests(TestCase):
+    def test_unknown_message_level_falls_back_to_debug(self):
+        hot_log = HotPathLogger(logging.getLogger('chat.tests.hot_path'))
+        with override_settings(CHAT_MESSAGE_LOG_LEVEL='LOUD'), self.assertLogs('chat.tests.hot_path', 'DEBUG') as logs:
+            hot_log.body("saved %s", 'hello')
+        self.assertEqual(logs.records[0].levelno, logging.DEBUG)
+
+        with override_settings(CHAT_MESSAGE_LOG_LEVEL='warning'), self.assertLogs('chat.tests.hot_path', 'DEBUG') as logs:
+            hot_log.body("saved %s", 'hello')
+        self.assertEqual(logs.records[0].levelno, logging.WARNING)
+
+
+class CodecTests(TestCase):
+    def test_codecs_round_trip_and_reject_bad_json(self):
+        frame = {'type': 'chat_message', 'message': {'id': 1, 'content': 'héllo "quoted"'}}
+        for choice in ('json', 'orjson'):
+            with self.subTest(codec=choice), override_settings(CHAT_JSON_CODEC=choice):
+                encoded = codec.dumps(frame)
+                self.assertIsInstance(encoded, str)
+                self.assertEqual(json.loads(encoded), frame)
+                self.assertEqual(codec.loads(encoded), frame)
+                with self.assertRaises(json.JSONDecodeError):
+                    codec.loads('{not json')
+
+    def test_events_carry_json_only(self):
+        payload = {'type': 'typing_indicator', 'sender_id': 1, 'is_typing': True}
+        event = codec.encode_event('typing_indicator_handler', payload)
+
+        self.assertEqual(set(event), {'type', 'text'})
+        self.assertEqual(msgpack.unpackb(codec.event_msgpack(event)), payload)
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class MsgpackSubprotocolTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+
+    def connect(self, user, subprotocols=None):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        return WebsocketCommunicator(
+            application, f'/ws/chat/?token={AccessToken.for_user(user)}', subprotocols=subprotocols,
+        )
+
+    def test_json_and_msgpack_clients_exchange_the_same_events(self):
+        async def scenario():
+            alice = self.connect(self.alice)
+            bob = self.connect(self.bob, subprotocols=['chat.msgpack', 'chat.json'])
+            self.assertEqual(await alice.connect(), (True, None))
+            self.assertEqual(await bob.connect(), (True, 'chat.msgpack'))
+            await alice.receive_json_from()
+            self.assertEqual(msgpack.unpackb(await bob.receive_from())['type'], 'connection')
+
+            await alice.send_json_to({'type': 'chat_message', 'receiver_id': self.bob.id, 'content': 'hi'})
+            self.assertEqual((await alice.receive_json_from())['type'], 'message_sent')
+            delivered = msgpack.unpackb(await bob.receive_from())
+
+            await bob.send_to(bytes_data=msgpack.packb({'type': 'read_up_to', 'message_id': delivered['message']['id']}))
+            receipt = await alice.receive_json_from()
+
+            await bob.send_to(bytes_data=b'\xc1')
+            error = msgpack.unpackb(await bob.receive_from())
+
+            await alice.disconnect()
+            await bob.disconnect()
+            await get_presence().close()
+            return delivered, receipt, error
+
+        delivered, receipt, error = async_to_sync(scenario)()
+
+        self.assertEqual(delivered['type'], 'chat_message')
+        self.assertEqual(delivered['message']['content'], 'hi')
+        self.assertEqual(delivered['sender_username'], 'alice')
+        self.assertEqual(receipt['type'], 'read_up_to')
+        self.assertEqual(receipt['read_by_id'], self.bob.id)
+        self.assertEqual(error, {'type': 'error', 'error': 'Invalid MessagePack format'})
+
+    def test_sync_cursors_may_use_integer_room_ids(self):
+        room = ChatRoom.get_or_create_room(self.alice, self.bob)
+        seen = Chat.objects.create(chatroom=room, sender=self.alice, receiver=self.bob, content='seen')
+        missed = Chat.objects.create(chatroom=room, sender=self.alice, receiver=self.bob, content='missed')
+
+        async def scenario():
+            bob = self.connect(self.bob, subprotocols=['chat.msgpack'])
+            await bob.connect()
+            await bob.receive_from()
+            await bob.send_to(bytes_data=msgpack.packb({'type': 'sync', 'cursors': {room.id: seen.seq}}))
+            frames = [msgpack.unpackb(await bob.receive_from()), msgpack.unpackb(await bob.receive_from())]
+            await bob.disconnect()
+            await get_presence().close()
+            return frames
+
+        batch, complete = async_to_sync(scenario)()
+
+        self.assertEqual([message['id'] for message in batch['messages']], [missed.id])
+        self.assertEqual(complete['cursors'], {str(room.id): missed.seq})
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class ReadUpToTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.room = ChatRoom.get_or_create_room(self.alice, self.bob)
+        self.messages = []
+        for sender, receiver in [(self.alice, self.bob), (self.bob, self.alice), (self.alice, self.bob), (self.alice, self.bob)]:
+            message = Chat.objects.create(chatroom=self.room, sender=sender, receiver=receiver, content='hi')
+            InboxState.record_message(message)
+            self.messages.append(message)
+
+    def unread(self, user):
+        return InboxState.objects.get(room=self.room, user=user).unread_count
+
+    def test_one_receipt_covers_every_earlier_message(self):
+        async def scenario():
+            application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+            alice = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(self.alice)}')
+            bob = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(self.bob)}')
+            await alice.connect()
+            await bob.connect()
+            await alice.receive_json_from()
+            await bob.receive_json_from()
+
+            await bob.send_json_to({'type': 'read_up_to', 'message_id': self.messages[2].id})
+            first = await alice.receive_json_from()
+            unread_after_first = await sync_to_async(self.unread)(self.bob)
+            # Already read: no receipt; the next one only counts the newer message
+            await bob.send_json_to({'type': 'read_up_to', 'message_id': self.messages[2].id})
+            await bob.send_json_to({'type': 'read_up_to', 'message_id': self.messages[3].id})
+            second = await alice.receive_json_from()
+
+            await alice.disconnect()
+            await bob.disconnect()
+            await get_presence().close()
+            return first, unread_after_first, second
+
+        first, unread_after_first, second = async_to_sync(scenario)()
+
+        self.assertEqual(first, {
+            'type': 'read_up_to', 'chatroom_id': self.room.id, 'message_id': self.messages[2].id,
+            'count': 2, 'read_by_id': self.bob.id, 'read_by_username': 'bob',
+        })
+        self.assertEqual(unread_after_first, 1)
+        self.assertEqual((second['message_id'], second['count']), (self.messages[3].id, 1))
+        self.assertEqual(self.unread(self.bob), 0)
+        self.assertEqual(self.unread(self.alice), 1)
+        self.assertEqual(
+            list(Chat.objects.order_by('id').values_list('is_read', flat=True)), [True, False, True, True],
+        )
+
+
+@override_settings(**LOAD_TEST_SETTINGS, CHAT_SYNC_BATCH_SIZE=2)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        self.alice_bob = alice_bob = ChatRoom.get_or_create_room(self.alice, self.bob)
+        self.bob_carol = bob_carol = ChatRoom.get_or_create_room(self.bob, self.carol)
+        alice_carol = ChatRoom.get_or_create_room(self.alice, self.carol)
+        self.seen = Chat.objects.create(chatroom=alice_bob, sender=self.alice, receiver=self.bob, content='seen')
+        self.missed = [
+            Chat.objects.create(chatroom=alice_bob, sender=self.alice, receiver=self.bob, content='one'),
+            Chat.objects.create(chatroom=bob_carol, sender=self.carol, receiver=self.bob, content='two'),
+            Chat.objects.create(chatroom=alice_carol, sender=self.alice, receiver=self.carol, content='not bob'),
+            Chat.objects.create(chatroom=bob_carol, sender=self.bob, receiver=self.carol, content='from bob'),
+        ]
+
+    def sync(self, after_id=None, cursors=None):
+        async def scenario():
+            application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+            bob = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(self.bob)}')
+            await bob.connect()
+            await bob.receive_json_from()
+            await bob.send_json_to({'type': 'sync', 'after_id': after_id, 'cursors': cursors or {}})
+            frames = [await bob.receive_json_from()]
+            while frames[-1]['type'] != 'sync_complete':
+                frames.append(await bob.receive_json_from())
+            await bob.disconnect()
+            await get_presence().close()
+            return frames
+
+        return async_to_sync(scenario)()
+
+    def test_streams_missed_messages_across_rooms_in_batches(self):
+        frames = self.sync(self.seen.id)
+
+        self.assertEqual([frame['type'] for frame in frames], ['sync_batch', 'sync_batch', 'sync_complete'])
+        contents = [message['content'] for frame in frames[:-1] for message in frame['messages']]
+        self.assertEqual(contents, ['one', 'two', 'from bob'])
+        self.assertEqual([frame['has_more'] for frame in frames[:-1]], [True, False])
+        self.assertEqual(frames[0]['messages'][1]['sender_username'], 'carol')
+        self.assertEqual(frames[-1], {
+            'type': 'sync_complete',
+            'cursors': {str(self.alice_bob.id): 2, str(self.bob_carol.id): 2},
+            'last_id': self.missed[-1].id,
+            'truncated': False,
+        })
+
+    def test_cursors_resume_each_room_by_seq(self):
+        # A message with a lower id than one already seen elsewhere, as when
+        # its transaction committed late, is still found through its room's seq
+        late = Chat.objects.create(chatroom=self.alice_bob, sender=self.alice, receiver=self.bob, content='late')
+        frames = self.sync(after_id=late.id, cursors={self.alice_bob.id: 2, self.bob_carol.id: 1})
+
+        contents = [message['content'] for frame in frames[:-1] for message in frame['messages']]
+        self.assertEqual(contents, ['late', 'from bob'])
+        self.assertEqual(frames[-1]['cursors'], {str(self.alice_bob.id): 3, str(self.bob_carol.id): 2})
+
+    def test_cursors_only_read_the_users_own_rooms(self):
+        frames = self.sync(cursors={self.missed[2].chatroom_id: 0})
+
+        self.assertEqual([frame['type'] for frame in frames], ['sync_complete'])
+
+    def test_reads_each_room_as_a_seq_range(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.sync(after_id=self.seen.id, cursors={self.alice_bob.id: 1})
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"chat_chat"' in query['sql']]
+
+        plans = []
+        with connection.cursor() as cursor:
+            for sql in reads:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plans.append(' '.join(row[-1] for row in cursor.fetchall()))
+        # No OR over the user's whole history and no sort: the cursor room
+        # and the room found through after_id are index ranges on (chatroom, seq)
+        for plan in plans:
+            self.assertNotIn('MULTI-INDEX OR', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+        ranges = [plan for plan in plans if '(chatroom_id=? AND seq>? AND seq<?)' in plan]
+        self.assertEqual(len(ranges), len(plans) - 1)
+        self.assertGreaterEqual(len(ranges), 2)
+
+    @override_settings(CHAT_SYNC_MAX_MESSAGES=2)
+    def test_truncates_long_gaps(self):
+        frames = self.sync(0)
+
+        self.assertEqual([frame['type'] for frame in frames], ['sync_batch', 'sync_complete'])
+        self.assertEqual(frames[-1]['truncated'], True)
+        self.assertEqual(frames[-1]['last_id'], self.missed[0].id)
+
+
+class SequenceTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        self.room = ChatRoom.get_or_create_room(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, content, room=None):
+        return Chat.objects.create(chatroom=room or self.room, sender=self.alice, receiver=self.bob, content=content)
+
+    def test_seqs_are_consecutive_per_room(self):
+        other_room = ChatRoom.get_or_create_room(self.alice, self.carol)
+        first, second = self.send('one'), self.send('two')
+        elsewhere = Chat(chatroom=other_room, sender=self.alice, receiver=self.carol, content='other')
+        batch = [Chat(chatroom=self.room, sender=self.alice, receiver=self.bob, content=f'batch {i}') for i in range(3)]
+        Chat.assign_seqs(batch + [elsewhere])
+        Chat.objects.bulk_create(batch + [elsewhere])
+
+        self.assertEqual([first.seq, second.seq], [1, 2])
+        self.assertEqual([message.seq for message in batch], [3, 4, 5])
+        self.assertEqual(elsewhere.seq, 1)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_seq, 5)
+
+    def test_backfill_numbers_each_room_without_gaps(self):
+        other_room = ChatRoom.get_or_create_room(self.alice, self.carol)
+        empty_room = ChatRoom.get_or_create_room(self.bob, self.carol)
+        for i in range(4):
+            self.send(f'one {i}')
+            self.send(f'other {i}', room=other_room)
+        # A late-committed row: highest id, earliest timestamp
+        early = self.send('early')
+        first = Chat.objects.order_by('timestamp')[0]
+        Chat.objects.filter(id=early.id).update(timestamp=first.timestamp - timedelta(seconds=1))
+        Chat.objects.update(seq=F('seq') + 100)
+        ChatRoom.objects.update(last_seq=0)
+
+        import_module('chat.migrations.0014_chat_seq').backfill_seqs(apps, None)
+
+        for room, count in [(self.room, 5), (other_room, 4), (empty_room, 0)]:
+            seqs = list(Chat.objects.filter(chatroom=room).order_by('timestamp', 'id').values_list('seq', flat=True))
+            self.assertEqual(seqs, list(range(1, count + 1)))
+            room.refresh_from_db()
+            self.assertEqual(room.last_seq, count)
+        self.assertEqual(Chat.objects.get(id=early.id).seq, 1)
+
+    def test_batches_lock_rooms_in_id_order(self):
+        other_room = ChatRoom.get_or_create_room(self.alice, self.carol)
+        batch = [
+            Chat(chatroom=other_room, sender=self.alice, receiver=self.carol, content='later room first'),
+            Chat(chatroom=self.room, sender=self.alice, receiver=self.bob, content='earlier room second'),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Chat.assign_seqs(batch)
+                Chat.objects.bulk_create(batch)
+                InboxState.record_messages(batch)
+
+        room_updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "chat_chatroom"')]
+        inbox_updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "chat_inboxstate"')]
+        self.assertEqual([sql.endswith(f'= {self.room.id} RETURNING last_seq') for sql in room_updates], [True, False])
+        self.assertEqual([f'"room_id" = {self.room.id}' in sql for sql in inbox_updates], [True, False])
+
+    def test_pages_report_what_lies_beyond_them(self):
+        for i in range(1, 6):
+            self.send(f'message {i}')
+        url = f'/chat/conversation/{self.bob.id}/'
+
+        newest = self.client.get(url, {'limit': 2})
+        self.assertEqual([m['seq'] for m in newest.data['messages']], [4, 5])
+        self.assertEqual((newest.data['has_more_before'], newest.data['has_more_after']), (True, False))
+
+        first = self.client.get(url, {'after_seq': 0, 'limit': 2})
+        self.assertEqual([m['seq'] for m in first.data['messages']], [1, 2])
+        self.assertEqual((first.data['has_more_before'], first.data['has_more_after']), (False, True))
+
+        past_the_end = self.client.get(url, {'after_seq': 5})
+        self.assertEqual(past_the_end.data['messages'], [])
+        self.assertTrue(past_the_end.data['has_more_before'])
+
+        self.assertEqual(len(self.client.get(url, {'limit': 'lots'}).data['messages']), 5)
+        self.assertEqual(self.client.get(url, {'after': 'garbage'}).status_code, 400)
+
+    def test_exact_ranges_by_seq(self):
+        for i in range(1, 8):
+            self.send(f'message {i}')
+        url = f'/chat/conversation/{self.bob.id}/'
+
+        response = self.client.get(url, {'after_seq': 2, 'limit': 3})
+        self.assertEqual([m['seq'] for m in response.data['messages']], [3, 4, 5])
+        self.assertTrue(response.data['has_more_after'])
+
+        response = self.client.get(url, {'before': response.data['before_cursor'], 'limit': 5})
+        self.assertEqual([m['seq'] for m in response.data['messages']], [1, 2])
+        self.assertFalse(response.data['has_more_before'])
+
+        response = self.client.get(url, {'before_seq': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, sender, receiver, content):
+        room = ChatRoom.get_or_create_room(sender, receiver)
+        return Chat.objects.create(chatroom=room, sender=sender, receiver=receiver, content=content)
+
+    def search(self, **params):
+        return self.client.get('/chat/search/', params)
+
+    def test_ranked_matches_from_own_rooms_only(self):
+        best = self.send(self.bob, self.alice, 'deploy deploy the deploy script')
+        other = self.send(self.alice, self.carol, 'deploying tomorrow')
+        self.send(self.bob, self.carol, 'deploy without alice')
+        self.send(self.alice, self.bob, 'lunch?')
+
+        response = self.search(q='deploy')
+
+        self.assertEqual([m['id'] for m in response.data['data']], [best.id, other.id])
+        self.assertEqual(response.data['data'][0]['chatroom_id'], best.chatroom_id)
+        self.assertEqual(response.data['data'][0]['sender_username'], 'bob')
+
+    def test_paginates_ties_and_group_committed_rows(self):
+        room = ChatRoom.get_or_create_room(self.alice, self.bob)
+        messages = [Chat(chatroom=room, sender=self.alice, receiver=self.bob, content='same words') for _ in range(5)]
+        Chat.assign_seqs(messages)
+        Chat.objects.bulk_create(messages)
+
+        seen, cursor = [], None
+        while True:
+            response = self.search(q='words "same', limit=2, **({'after': cursor} if cursor else {}))
+            seen += [m['id'] for m in response.data['data']]
+            cursor = response.data['next_cursor']
+            if not response.data['has_more']:
+                break
+
+        self.assertEqual(seen, sorted((m.id for m in messages), reverse=True))
+        self.assertEqual(self.search(q='?').data['count'], 0)
+        self.assertEqual(self.search(q='').status_code, 400)
+        self.assertEqual(self.search(q='same', after='bad').status_code, 400)
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dana', email='dana@example.com', password='S3cret!pass')
+        self.client = APIClient()
+
+    def login(self, email, password='S3cret!pass'):
+        return self.client.post('/chat/login/', {'email': email, 'password': password}, format='json')
+
+    def test_one_case_insensitive_lookup_and_hash_upgrade(self):
+        with self.assertNumQueries(1):
+            response = self.login('Dana@Example.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['userDetails']['username'], 'dana')
+        self.assertEqual(self.login('dana@example.com', 'wrong').status_code, 400)
+        self.assertEqual(self.login('nobody@example.com').status_code, 400)
+
+        with self.settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.Argon2PasswordHasher',
+                                             'django.contrib.auth.hashers.PBKDF2PasswordHasher']):
+            self.assertEqual(self.login('dana@example.com').status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith('argon2'))
+            self.assertEqual(self.login('dana@example.com').status_code, 200)
+
+    @override_settings(PASSWORD_HASH_TIMEOUT=0)
+    def test_sheds_logins_when_hashing_pool_is_busy(self):
+        response = self.login('dana@example.com')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class HandshakeCacheTests(TestCase):
+    def setUp(self):
+        token_user_cache.clear()
+        self.addCleanup(token_user_cache.clear)
+
+    def test_repeat_handshake_skips_the_user_query(self):
+        user = User.objects.create_user(username='grace', email='grace@example.com')
+        token = str(AccessToken.for_user(user))
+
+        with self.assertNumQueries(1):
+            first = async_to_sync(resolve_user)(token)
+        with self.assertNumQueries(0):
+            again = async_to_sync(resolve_user)(token)
+
+        self.assertEqual((again.id, again.username, again.email), (user.id, 'grace', 'grace@example.com'))
+        self.assertEqual(first.id, again.id)
+
+    def test_entries_end_with_the_token_and_evict_the_oldest(self):
+        snapshot = {'id': 1, 'username': 'grace'}
+        cache = TokenUserCache(max_size=2, ttl=300)
+
+        cache.set('expired', snapshot, time.time() - 1, 'jti')
+        self.assertIsNone(cache.get('expired'))
+
+        for token in ('a', 'b', 'c'):
+            cache.set(token, snapshot, time.time() + 60, token)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), (snapshot, 'c'))
+
+        disabled = TokenUserCache(max_size=0, ttl=300)
+        disabled.set('a', snapshot, time.time() + 60, 'a')
+        self.assertIsNone(disabled.get('a'))
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class RevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='erin', email='erin@example.com')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = str(self.refresh.access_token)
+        self.client = APIClient()
+
+    def connects(self, token):
+        async def scenario():
+            application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+            communicator = WebsocketCommunicator(application, f'/ws/chat/?token={token}')
+            connected, _ = await communicator.connect()
+            if connected:
+                await communicator.disconnect()
+            await get_presence().close()
+            return connected
+
+        return async_to_sync(scenario)()
+
+    def test_logout_revokes_refresh_and_access_tokens(self):
+        self.assertTrue(self.connects(self.access))
+
+        self.client.cookies['refresh_token'] = str(self.refresh)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(self.client.post('/chat/logout/').status_code, 200)
+
+        # Rejected even though the handshake cache still holds this token
+        self.assertFalse(self.connects(self.access))
+        self.client.credentials()
+        self.client.cookies['refresh_token'] = str(self.refresh)
+        with self.assertNumQueries(0):
+            response = self.client.post('/chat/refresh/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_other_tokens_keep_working(self):
+        other = RefreshToken.for_user(self.user)
+        self.client.force_authenticate(self.user)
+        self.client.cookies['refresh_token'] = str(self.refresh)
+        self.client.post('/chat/logout/')
+
+        self.assertTrue(self.connects(str(other.access_token)))
+        self.client.cookies['refresh_token'] = str(other)
+        self.assertEqual(self.client.post('/chat/refresh/').status_code, 200)
+
+
+@override_settings(**LOAD_TEST_SETTINGS)
+class GroupRoomTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def connect(self, user):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        return WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(user)}')
+
+    def create_group(self, member_ids):
+        response = self.client.post('/chat/groups/', {'name': ' team ', 'member_ids': member_ids}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']
+
+    def test_message_is_published_once_to_every_other_member(self):
+        group = self.create_group([self.bob.id, self.carol.id])
+        self.assertEqual(group['name'], 'team')
+        self.assertEqual(group['participant_ids'], sorted([self.alice.id, self.bob.id, self.carol.id]))
+
+        async def scenario():
+            sockets = [self.connect(user) for user in (self.alice, self.bob, self.carol)]
+            for socket in sockets:
+                await socket.connect()
+                await socket.receive_json_from()
+            alice, bob, carol = sockets
+
+            await alice.send_json_to({'type': 'chat_message', 'chatroom_id': group['id'], 'content': 'hi all'})
+            sent = await alice.receive_json_from()
+            received = [await bob.receive_json_from(), await carol.receive_json_from()]
+
+            await bob.send_json_to({'type': 'read_up_to', 'message_id': sent['message']['id']})
+            receipt = await alice.receive_json_from()
+            carol_receipt = await carol.receive_json_from()
+            # Neither the sender nor the reader gets its own event back
+            echoes = [await alice.receive_nothing(), await bob.receive_nothing()]
+
+            for socket in sockets:
+                await socket.disconnect()
+            await get_presence().close()
+            return sent, received, receipt, carol_receipt, echoes
+
+        sent, received, receipt, carol_receipt, echoes = async_to_sync(scenario)()
+
+        self.assertEqual(sent['type'], 'message_sent')
+        self.assertEqual(sent['message']['chatroom_id'], group['id'])
+        for frame in received:
+            self.assertEqual(frame['type'], 'chat_message')
+            self.assertEqual(frame['message']['content'], 'hi all')
+            self.assertEqual(frame['sender_username'], 'alice')
+        self.assertEqual(receipt['type'], 'read_up_to')
+        self.assertEqual(receipt['read_by_id'], self.bob.id)
+        self.assertEqual(carol_receipt, receipt)
+        self.assertEqual(echoes, [True, True])
+
+        states = {state.user_id: state for state in InboxState.objects.filter(room_id=group['id'])}
+        self.assertEqual(states[self.alice.id].unread_count, 0)
+        self.assertEqual(states[self.bob.id].unread_count, 0)
+        self.assertEqual(states[self.bob.id].last_read_seq, sent['message']['seq'])
+        self.assertEqual(states[self.carol.id].unread_count, 1)
+
+        history = self.client.get(f"/chat/groups/{group['id']}/messages/")
+        self.assertEqual([message['content'] for message in history.data['messages']], ['hi all'])
+
+    def test_members_join_and_leave_while_connected(self):
+        group = self.create_group([self.bob.id])
+
+        async def scenario():
+            carol = self.connect(self.carol)
+            await carol.connect()
+            await carol.receive_json_from()
+
+            response = await sync_to_async(self.client.post)(
+                f"/chat/groups/{group['id']}/members/", {'user_ids': [self.carol.id]}, format='json',
+            )
+            joined = await carol.receive_json_from()
+
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await alice.receive_json_from()
+            await alice.send_json_to({'type': 'chat_message', 'chatroom_id': group['id'], 'content': 'welcome'})
+            await alice.receive_json_from()
+            message = await carol.receive_json_from()
+
+            carol_client = APIClient()
+            carol_client.force_authenticate(self.carol)
+            left = await sync_to_async(carol_client.delete)(f"/chat/groups/{group['id']}/members/{self.carol.id}/")
+            left_event = await carol.receive_json_from()
+            await alice.send_json_to({'type': 'chat_message', 'chatroom_id': group['id'], 'content': 'bye'})
+            await alice.receive_json_from()
+            after_leaving = await carol.receive_nothing()
+
+            await alice.disconnect()
+            await carol.disconnect()
+            await get_presence().close()
+            return response, joined, message, left, left_event, after_leaving
+
+        response, joined, message, left, left_event, after_leaving = async_to_sync(scenario)()
+
+        self.assertEqual(response.data['added'], [self.carol.id])
+        self.assertEqual(joined, {'type': 'room_joined', 'chatroom_id': group['id'], 'name': 'team'})
+        self.assertEqual(message['message']['content'], 'welcome')
+        self.assertEqual(left.status_code, 204)
+        self.assertEqual(left_event['type'], 'room_left')
+        self.assertTrue(after_leaving)
+        self.assertFalse(InboxState.objects.filter(room_id=group['id'], user=self.carol).exists())
+
+    def test_direct_only_frames_are_rejected_in_groups(self):
+        group = self.create_group([self.bob.id])
+
+        async def scenario():
+            alice, bob = self.connect(self.alice), self.connect(self.bob)
+            for socket in (alice, bob):
+                await socket.connect()
+                await socket.receive_json_from()
+            await alice.send_json_to({'type': 'chat_message', 'chatroom_id': group['id'], 'content': 'hi'})
+            await alice.receive_json_from()
+            message = await bob.receive_json_from()
+
+            await bob.send_json_to({'type': 'read_receipt', 'message_id': message['message']['id']})
+            receipt_error = await bob.receive_json_from()
+            await bob.send_json_to({'type': 'typing', 'is_typing': True})
+            typing_error = await bob.receive_json_from()
+
+            for socket in (alice, bob):
+                await socket.disconnect()
+            await get_presence().close()
+            return receipt_error, typing_error
+
+        receipt_error, typing_error = async_to_sync(scenario)()
+
+        self.assertEqual(receipt_error, {
+            'type': 'error', 'error': 'read_receipt is for direct messages; use read_up_to in group rooms',
+        })
+        self.assertEqual(typing_error, {'type': 'error', 'error': 'typing needs a receiver_id or a chatroom_id'})
+
+    def test_reading_up_to_a_group_after_leaving_it_is_ignored(self):
+        group = self.create_group([self.bob.id])
+        room = ChatRoom.objects.get(id=group['id'])
+
+        async def scenario():
+            bob = self.connect(self.bob)
+            await bob.connect()
+            await bob.receive_json_from()
+            await bob.send_json_to({'type': 'chat_message', 'chatroom_id': group['id'], 'content': 'bye'})
+            sent = await bob.receive_json_from()
+            await sync_to_async(room.remove_member)(self.bob.id)
+
+            # This socket has not heard about the removal yet; a new one has
+            await bob.send_json_to({'type': 'read_up_to', 'message_id': sent['message']['id']})
+            stale = await bob.receive_nothing()
+            fresh = self.connect(self.bob)
+            await fresh.connect()
+            await fresh.receive_json_from()
+            await fresh.send_json_to({'type': 'read_up_to', 'message_id': sent['message']['id']})
+            after = await fresh.receive_nothing()
+
+            await bob.disconnect()
+            await fresh.disconnect()
+            await get_presence().close()
+            return stale, after
+
+        self.assertEqual(async_to_sync(scenario)(), (True, True))
+        self.assertFalse(InboxState.objects.filter(room=room, user=self.bob).exists())
+
+    def test_non_members_cannot_post_or_read(self):
+        group = self.create_group([self.bob.id])
+        outsider = APIClient()
+        outsider.force_authenticate(self.carol)
+
+        self.assertEqual(outsider.get(f"/chat/groups/{group['id']}/messages/").status_code, 404)
+        self.assertEqual(
+            outsider.post(f"/chat/groups/{group['id']}/members/", {'user_ids': [self.carol.id]}, format='json').status_code,
+            404,
+        )
+        self.assertEqual(self.client.delete(f"/chat/groups/{group['id']}/members/{self.bob.id}/").status_code, 403)
+
+
+class TypingThrottleTests(TestCase):
+    def test_repeats_are_suppressed_and_idle_typing_auto_stops(self):
+        async def scenario():
+            forwarded = []
+
+            async def forward(is_typing):
+                forwarded.append(is_typing)
+
+            throttle = TypingThrottle(window=60, timeout=0.05)
+            results = [await throttle.submit(1, 2, True, forward) for _ in range(3)]
+            results.append(await throttle.submit(1, 3, True, forward))
+            await asyncio.sleep(0.1)
+            return results, forwarded, dict(throttle.counters), throttle.state
+
+        results, forwarded, counters, state = async_to_sync(scenario)()
+
+        # Only the first "typing" per pair goes out; both pairs then stop on their own
+        self.assertEqual(results, [True, False, False, True])
+        self.assertEqual(forwarded, [True, True, False, False])
+        self.assertEqual(counters, {'forwarded': 4, 'suppressed': 2, 'auto_stopped': 2})
+        self.assertEqual(state, {})
+
+    def test_state_changes_are_forwarded_and_repeated_stops_dropped(self):
+        async def scenario():
+            forwarded = []
+
+            async def forward(is_typing):
+                forwarded.append(is_typing)
+
+            throttle = TypingThrottle(window=60, timeout=60)
+            for is_typing in (True, False, False, True):
+                await throttle.submit(1, 2, is_typing, forward)
+            for state in throttle.state.values():
+                state.timer.cancel()
+            return forwarded, dict(throttle.counters)
+
+        forwarded, counters = async_to_sync(scenario)()
+
+        self.assertEqual(forwarded, [True, False, True])
+        self.assertEqual(counters, {'forwarded': 3, 'suppressed': 1, 'auto_stopped': 0})
+
+
+class OutboundQueueTests(TestCase):
+    def test_coalesces_typing_and_refuses_other_frames_when_full(self):
+        async def scenario():
+            sent = []
+            gate = asyncio.Event()
+
+            async def send(frame):
+                await gate.wait()
+                sent.append(frame)
+
+            queue = OutboundQueue(send, limit=3)
+            queue.start()
+            accepted = [
+                queue.put('one', message_id=1),
+                queue.put('typing', coalesce='typing:7'),
+                queue.put('two', message_id=2),
+                queue.put('stopped typing', coalesce='typing:7'),
+                queue.put('other typing', coalesce='typing:8'),
+                queue.put('three', message_id=3),
+            ]
+            gate.set()
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            queue.close()
+            return accepted, sent, queue.delivered_id
+
+        accepted, sent, delivered_id = async_to_sync(scenario)()
+
+        # The newer typing state takes the queued one's place; the full
+        # queue drops further typing and refuses the chat message
+        self.assertEqual(accepted, [True, True, True, True, True, False])
+        self.assertEqual(sent, ['one', 'stopped typing', 'two'])
+        self.assertEqual(delivered_id, 2)
+
+
+    def test_tracks_the_newest_seq_sent_per_room(self):
+        async def scenario():
+            sent = []
+            stuck = asyncio.Event()
+
+            async def send(frame):
+                if frame == 'not sent':
+                    await stuck.wait()
+                sent.append(frame)
+
+            queue = OutboundQueue(send, limit=10)
+            queue.start()
+            # Room 7's seq 4 committed late, with a lower id than room 8's message
+            queue.put('room 8', message_id=20, cursors={8: 1})
+            queue.put('room 7', message_id=19, cursors={7: 4})
+            queue.put('sync batch', message_id=18, cursors={7: 3, 9: 2})
+            queue.put('not sent', message_id=21, cursors={7: 5})
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            queue.close()
+            return queue.cursors, queue.delivered_id
+
+        cursors, delivered_id = async_to_sync(scenario)()
+
+        self.assertEqual(cursors, {7: 4, 8: 1, 9: 2})
+        self.assertEqual(delivered_id, 20)
+
+
+@override_settings(**LOAD_TEST_SETTINGS, CHAT_OUTBOUND_QUEUE_LIMIT=0)
+class SlowConsumerTests(TestCase):
+    def test_full_queue_disconnects_with_resume_hint(self):
+        user = User.objects.create_user(username='frank', email='frank@example.com')
+
+        async def scenario():
+            application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+            communicator = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(user)}')
+            await communicator.connect()
+            hint = await communicator.receive_json_from()
+            closed = await communicator.receive_output()
+            await communicator.disconnect()
+            await get_presence().close()
+            return hint, closed
+
+        hint, closed = async_to_sync(scenario)()
+
+        self.assertEqual(hint, {'type': 'resume', 'reason': 'slow_consumer', 'cursors': {}, 'after_id': 0})
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 4008})
+
+
+class DeploymentConfigTests(TestCase):
+    def load(self, path, **env):
+        with mock.patch.dict(os.environ, env):
+            return runpy.run_path(str(settings.BASE_DIR / path))
+
+    def test_gunicorn_roles(self):
+        http = self.load('gunicorn.conf.py', SERVER_ROLE='http', WEB_CONCURRENCY='3', MAX_REQUESTS='500')
+        ws = self.load('gunicorn.conf.py', SERVER_ROLE='ws', WEB_CONCURRENCY='3')
+
+        self.assertEqual((http['workers'], ws['workers']), (3, 3))
+        self.assertEqual(http['worker_class'], 'uvicorn_worker.UvicornWorker')
+        # API workers are recycled; socket workers never are, and drain slowly
+        self.assertEqual((http['max_requests'], http['graceful_timeout']), (500, 30))
+        self.assertEqual((ws['max_requests'], ws['graceful_timeout']), (0, 120))
+
+    def test_postgres_pool_modes(self):
+        native = self.load('backend/settings.py', DB_ENGINE='postgres', DB_POOL_MAX_SIZE='8')
+        pgbouncer = self.load('backend/settings.py', DB_ENGINE='postgres', DB_POOL_MODE='pgbouncer')
+
+        database = native['DATABASES']['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 8)
+        self.assertEqual(native['DB_THREAD_POOL_SIZE'], 8)
+        database = pgbouncer['DATABASES']['default']
+        self.assertNotIn('pool', database['OPTIONS'])
+        self.assertEqual((database['CONN_MAX_AGE'], database['DISABLE_SERVER_SIDE_CURSORS']), (60, True))
+
+    def test_db_calls_use_the_thread_pool_when_sized(self):
+        def thread_name():
+            return threading.current_thread().name
+
+        with override_settings(DB_THREAD_POOL_SIZE=1):
+            self.assertEqual(async_to_sync(database_sync_to_async(thread_name))(), threading.current_thread().name)
+        with override_settings(DB_THREAD_POOL_SIZE=2), mock.patch('chat.db._executor', None):
+            self.assertTrue(async_to_sync(database_sync_to_async(thread_name))().startswith('chat-db'))
+            get_db_executor().shutdown()
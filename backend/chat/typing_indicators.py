@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+
+from chat.metrics import typing_events
+
+logger = logging.getLogger(__name__)
+
+
+class TypingState:
+    __slots__ = ('is_typing', 'forwarded_at', 'timer')
+
+    def __init__(self, is_typing, forwarded_at, timer=None):
+        self.is_typing = is_typing
+        self.forwarded_at = forwarded_at
+        self.timer = timer
+
+
+class TypingThrottle:
+    """Server-side throttling of typing events per (sender, receiver) pair.
+
+    A state equal to the last one forwarded within ``window`` seconds is
+    dropped. A pair that stays "typing" without any event for ``timeout``
+    seconds gets an automatic "stopped typing", so receivers never see a
+    stuck indicator when a client goes away mid-word.
+    """
+
+    def __init__(self, window, timeout):
+        self.window = window
+        self.timeout = timeout
+        self.state = {}
+        self.counters = {'forwarded': 0, 'suppressed': 0, 'auto_stopped': 0}
+
+    def count(self, outcome):
+        self.counters[outcome] += 1
+        typing_events.labels(outcome).inc()
+
+    async def submit(self, sender_id, receiver_id, is_typing, forward):
+        """Forward ``is_typing`` with ``forward(is_typing)`` unless it is a repeat"""
+        key = (sender_id, receiver_id)
+        now = time.monotonic()
+        state = self.state.get(key)
+
+        if state is not None and state.is_typing == is_typing and now - state.forwarded_at < self.window:
+            if is_typing:
+                self.arm_auto_stop(key, state, forward)
+            self.count('suppressed')
+            return False
+
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+
+        state = self.state[key] = TypingState(is_typing, now)
+        if is_typing:
+            self.arm_auto_stop(key, state, forward)
+        else:
+            # Stopped pairs are only kept long enough to drop repeated stops
+            state.timer = asyncio.get_running_loop().call_later(self.window, self.forget, key, state)
+
+        self.count('forwarded')
+        await forward(is_typing)
+        return True
+
+    def arm_auto_stop(self, key, state, forward):
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(self.timeout, self.auto_stop, key, state, forward)
+
+    def auto_stop(self, key, state, forward):
+        if self.state.get(key) is not state:
+            return
+        del self.state[key]
+        self.count('auto_stopped')
+        self.count('forwarded')
+        asyncio.ensure_future(self.send_auto_stop(forward))
+
+    async def send_auto_stop(self, forward):
+        try:
+            await forward(False)
+        except Exception as e:
+            logger.error("Error sending automatic typing stop: %s", e)
+
+    def forget(self, key, state):
+        if self.state.get(key) is state:
+            del self.state[key]
+
+
+_throttles = weakref.WeakKeyDictionary()
+
+
+def get_typing_throttle():
+    loop = asyncio.get_running_loop()
+    throttle = _throttles.get(loop)
+    if throttle is None:
+        throttle = _throttles[loop] = TypingThrottle(
+            window=getattr(settings, 'TYPING_THROTTLE_WINDOW_SECONDS', 2.5),
+            timeout=getattr(settings, 'TYPING_AUTO_STOP_SECONDS', 5),
+        )
+    return throttle
+
@@ -9,6 +9,10 @@ from .views import (
     ConversationView,
     ListAllUsers,
     ConversationListView,
+    MessageSearchView,
+    GroupListView,
+    GroupMembersView,
+    GroupConversationView,
 )
 
 urlpatterns = [
@@ -23,4 +27,9 @@ urlpatterns = [
     # Chat
     path("conversation/<int:user_id>/", ConversationView.as_view(), name="conversation"),
     path("conversations/", ConversationListView.as_view(), name="conversation"),
+    path("search/", MessageSearchView.as_view(), name="message_search"),
+    path("groups/", GroupListView.as_view(), name="groups"),
+    path("groups/<int:room_id>/messages/", GroupConversationView.as_view(), name="group_conversation"),
+    path("groups/<int:room_id>/members/", GroupMembersView.as_view(), name="group_members"),
+    path("groups/<int:room_id>/members/<int:user_id>/", GroupMembersView.as_view(), name="group_member"),
 ]
@@ -1,17 +1,29 @@
-from chat.serializer import UserSerializer,CustomTokenObtainPairSerializer,ChatSerializer,ChatRoomSerializer,UserListSerializer
-from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from chat.serializer import UserSerializer,CustomTokenObtainPairSerializer,ChatSerializer,InboxStateSerializer,UserListSerializer,MessageSearchSerializer,RevocableTokenRefreshSerializer,GroupRoomSerializer,validate_group_members
+from rest_framework import serializers
 from rest_framework.permissions import IsAuthenticated,AllowAny
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import generics, status, permissions   
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from prometheus_client import CONTENT_TYPE_LATEST
 from django.db import DatabaseError
+from django.db.models import Prefetch
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework.response import Response  
 from django.contrib.auth.models import User
-from chat.models import ChatRoom,Chat
+from chat.models import ChatRoom,Chat,InboxState
 from rest_framework.views import APIView
 from django.shortcuts import render
-from .models import UserStatus
+from django.http import Http404, HttpResponse
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from .pagination import InvalidCursor, message_position, paginate_messages, paginate_users, page_cursors
+from .groups import notify_membership
+from .presence import presence_snapshot
+from .search import search_messages
+from .metrics import render as render_metrics
+from .passwords import PasswordHashBusy
+from .revocation import revoke_token
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,  
     TokenRefreshView      
@@ -37,6 +49,11 @@ class UserRegistration(APIView):
                     'message': 'User created successfully',
                     'user_id': user.id
                 }, status=status.HTTP_201_CREATED)
+            except PasswordHashBusy:
+                return Response({
+                    'success': False,
+                    'message': 'Too many requests right now, please retry'
+                }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
             except Exception as e:
                 logger.error(f"Error creating user: {str(e)}")
                 return Response({
@@ -74,7 +91,7 @@ class CustomTokenObtainPairView(TokenObtainPairView):
                 serializer.is_valid(raise_exception=True)
                 token_data = serializer.validated_data
                 
-                user = User.objects.get(email__iexact=email.strip())
+                user = serializer.user
                 
                 access_token = token_data['access']
                 refresh_token = token_data['refresh']
@@ -121,6 +138,13 @@ class CustomTokenObtainPairView(TokenObtainPairView):
                     {"success": False, "message": str(e)},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            except PasswordHashBusy:
+                logger.warning("Password hashing pool busy, login shed")
+                return Response(
+                    {"success": False, "message": "Too many login attempts right now, please retry"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": "1"},
+                )
             except serializers.ValidationError as e:
                 logger.warning(f"Validation error: {str(e)}")
                 return Response(
@@ -150,7 +174,7 @@ class CustomTokenRefreshView(TokenRefreshView):
                     status=status.HTTP_401_UNAUTHORIZED
                 )
                 
-            serializer=TokenRefreshSerializer(data={'refresh': refresh_token})
+            serializer=RevocableTokenRefreshSerializer(data={'refresh': refresh_token})
             if serializer.is_valid():
                 validated_data = serializer.validated_data
                 access_token = str(validated_data['access'])
@@ -200,7 +224,7 @@ class CustomTokenRefreshView(TokenRefreshView):
                 )
                     
 class Logout(APIView):
-    '''User logout section with addition of token blacklisting'''
+    '''User logout; revokes the refresh and access tokens in chat.revocation'''
     def post(self,request,*args, **kwargs):
         
         try:
@@ -208,10 +232,13 @@ class Logout(APIView):
             
             if refresh_tokens:
                 try:
-                    token=RefreshToken(refresh_tokens)
-                    token.blacklist()
-                except:
+                    revoke_token(RefreshToken(refresh_tokens))
+                except TokenError:
                     pass
+
+            # The access token too, so it can no longer open WebSocket connections
+            if request.auth is not None:
+                revoke_token(request.auth)
                 
             res = Response(
                 {"success": True, "message": "Logout successful"},
@@ -249,17 +276,106 @@ class ConversationView(APIView):
             return Response({"error": "User not found"}, status=404)
 
         room = ChatRoom.get_or_create_room(request.user, other_user)
-        messages = Chat.objects.filter(chatroom=room)\
-                            .select_related('sender', 'receiver')\
-                            .order_by('timestamp')
+        return room_history_response(request, room)
 
-        serializer = ChatSerializer(messages, many=True)
-        
+
+def room_history_response(request, room):
+    """One page of a room's history, for ConversationView and GroupConversationView"""
+    messages = Chat.objects.filter(chatroom=room)\
+                        .select_related('sender', 'receiver')
+
+    try:
+        page = paginate_messages(
+            messages,
+            before=message_position(request.query_params.get('before'), request.query_params.get('before_seq')),
+            after=message_position(request.query_params.get('after'), request.query_params.get('after_seq')),
+            limit=request.query_params.get('limit'),
+        )
+    except InvalidCursor:
+        return Response({"error": "Invalid cursor"}, status=400)
+
+    before_cursor, after_cursor = page_cursors(page['messages'])
+    serializer = ChatSerializer(page['messages'], many=True)
+    
+    return Response({
+        "chatroom_id": room.id,
+        "messages": serializer.data,
+        "has_more_before": page['has_more_before'],
+        "has_more_after": page['has_more_after'],
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor,
+    }, status=200)
+
+
+def get_group_for_member(user, room_id):
+    """The group room ``room_id`` if ``user`` is in it, else raise Http404"""
+    try:
+        return ChatRoom.objects.get(id=room_id, is_group=True, participants=user)
+    except ChatRoom.DoesNotExist:
+        raise Http404
+
+
+class GroupListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = GroupRoomSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Validation failed',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        member_ids = [request.user.id] + [
+            user_id for user_id in serializer.validated_data['member_ids'] if user_id != request.user.id
+        ]
+        room = ChatRoom.create_group(serializer.validated_data['name'], member_ids)
+        # Open sockets of every member join room_<id> straight away
+        notify_membership(room, member_ids, joined=True)
         return Response({
-            "chatroom_id": room.id,
-            "messages": serializer.data
-        }, status=200)
-        
+            'success': True,
+            'data': GroupRoomSerializer(room).data,
+        }, status=status.HTTP_201_CREATED)
+
+
+class GroupMembersView(APIView):
+    """Members add others to a group (POST) and leave it (DELETE on themselves)"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        room = get_group_for_member(request.user, room_id)
+        try:
+            user_ids = validate_group_members(
+                [int(user_id) for user_id in request.data.get('user_ids', [])],
+                extra=room.participants.count(),
+            )
+        except (TypeError, ValueError):
+            return Response({"success": False, "message": "user_ids must be a list of ids"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except serializers.ValidationError as e:
+            return Response({"success": False, "message": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        added = room.add_members(user_ids)
+        notify_membership(room, added, joined=True)
+        return Response({'success': True, 'added': added}, status=status.HTTP_200_OK)
+
+    def delete(self, request, room_id, user_id):
+        if user_id != request.user.id:
+            return Response({"success": False, "message": "You can only remove yourself"},
+                            status=status.HTTP_403_FORBIDDEN)
+        room = get_group_for_member(request.user, room_id)
+        room.remove_member(user_id)
+        notify_membership(room, [user_id], joined=False)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class GroupConversationView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id):
+        return room_history_response(request, get_group_for_member(request.user, room_id))
+
         
 
 class ConversationListView(APIView):
@@ -267,8 +383,13 @@ class ConversationListView(APIView):
 
     def get(self, request):
         try:
-            conversations = ChatRoom.objects.filter(participants=request.user)
-            serializer = ChatRoomSerializer(
+            conversations = InboxState.objects.filter(user=request.user)\
+                .select_related('room', 'last_message__sender')\
+                .prefetch_related(
+                    Prefetch('room__participants', queryset=User.objects.only('id', 'username', 'email'))
+                )\
+                .order_by('-last_activity')
+            serializer = InboxStateSerializer(
                 conversations, context={"request": request}, many=True
             )
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -286,28 +407,80 @@ class ConversationListView(APIView):
             )
 
 
+class MessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"success": False, "message": "Search query is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            page = search_messages(
+                request.user,
+                query,
+                after=request.query_params.get('after'),
+                limit=request.query_params.get('limit'),
+            )
+        except InvalidCursor:
+            return Response(
+                {"success": False, "message": "Invalid cursor."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except DatabaseError as e:
+            return Response(
+                {"success": False, "message": "Database error occurred.", "error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        serializer = MessageSearchSerializer(page['messages'], many=True)
+        return Response(
+            {
+                'success': True,
+                'data': serializer.data,
+                'count': len(page['messages']),
+                'has_more': page['has_more'],
+                'next_cursor': page['next_cursor'],
+            },
+            status=status.HTTP_200_OK
+        )
+
+
 class ListAllUsers(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         try:
-            users = User.objects.exclude(id=request.user.id)
+            users = User.objects.exclude(id=request.user.id)\
+                .select_related('status')\
+                .only('id', 'username', 'email', 'status__is_online', 'status__last_seen')
 
-            # Ensure every user has a UserStatus object
-            for user in users:
-                try:
-                    if not hasattr(user, 'status'):
-                        UserStatus.objects.get_or_create(user=user)
-                except Exception as e:
-                    # Continue processing other users if one fails
-                    continue
+            try:
+                page = paginate_users(
+                    users,
+                    search=request.query_params.get('search'),
+                    after=request.query_params.get('after'),
+                    limit=request.query_params.get('limit'),
+                )
+            except InvalidCursor:
+                return Response(
+                    {"success": False, "message": "Invalid cursor."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-            serializer = UserListSerializer(users, many=True)
+            users = page['users']
+            presence = presence_snapshot([user.id for user in users])
+            serializer = UserListSerializer(users, many=True, context={'presence': presence})
             return Response(
                 {
                     'success': True,
                     'data': serializer.data,
-                    'count': users.count()
+                    'count': len(users),
+                    'has_more': page['has_more'],
+                    'next_cursor': page['next_cursor'],
                 },
                 status=status.HTTP_200_OK
             )
@@ -328,4 +501,19 @@ class ListAllUsers(APIView):
             return Response(
                 {"success": False, "message": "An unexpected error occurred.", "error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
\ No newline at end of file
+            )
+
+class MetricsView(APIView):
+    """Prometheus text exposition of chat.metrics, summed over the server's workers"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise Http404
+
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
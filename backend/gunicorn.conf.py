@@ -0,0 +1,60 @@
+"""
+Gunicorn config for serving backend.asgi:application with uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py backend.asgi:application
+
+Every worker is a separate process with its own event loop. Channel-layer
+groups (user_<id>) live in Redis, so a message sent from one worker reaches
+sockets held by any other.
+
+SERVER_ROLE picks the tuning for a pool:
+  http - REST API workers: recycled after MAX_REQUESTS, short shutdown
+  ws   - WebSocket workers: never recycled, long graceful shutdown so open
+         sockets get time to close and clients reconnect elsewhere
+  all  - one pool serving both (default)
+"""
+import multiprocessing
+import os
+import shutil
+
+role = os.environ.get('SERVER_ROLE', 'all')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Heartbeat timeout for a worker's event loop, not a request timeout
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+if role == 'http':
+    max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+    max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 1000))
+    graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+else:
+    max_requests = 0
+    graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+
+# chat.metrics: every worker writes its metrics to files here and /metrics/
+# sums them, whichever worker answers. Set before any worker imports
+# prometheus_client, and emptied at startup so old pids don't linger.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', f'/tmp/chat-metrics-{role}')
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the worker's live gauges (open sockets, queued frames, ...)
+    multiprocess.mark_process_dead(worker.pid)
+
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '*')
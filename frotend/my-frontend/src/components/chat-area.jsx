@@ -14,8 +14,14 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
   const [selectedUser, setSelectedUser] = useState(null)
   const [isTyping, setIsTyping] = useState(false)
   const [typingUser, setTypingUser] = useState(null)
+  const [beforeCursor, setBeforeCursor] = useState(null)
+  const [hasMoreBefore, setHasMoreBefore] = useState(false)
+  const [loadingOlder, setLoadingOlder] = useState(false)
   const messagesEndRef = useRef(null)
   const typingTimeoutRef = useRef(null)
+  const skipAutoScrollRef = useRef(false)
+  // Room id of the selected conversation, from the history response
+  const chatroomIdRef = useRef(null)
 
   // Force re-render key
   const [updateKey, setUpdateKey] = useState(0)
@@ -56,11 +62,14 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
 
   // Fetch messages when user is selected
   useEffect(() => {
+    chatroomIdRef.current = null
     if (selectedUserId) {
       fetchMessages()
     } else {
       setMessages([])
       setSelectedUser(null)
+      setBeforeCursor(null)
+      setHasMoreBefore(false)
     }
   }, [selectedUserId])
 
@@ -156,17 +165,34 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
       forceUpdate()
     }
 
+    const handleReadUpTo = (data) => {
+      console.log('✓ READ UP TO:', data)
+      // Receipts from other rooms (another chat, a shared group) say nothing about this one
+      if (parseInt(data.chatroom_id) !== chatroomIdRef.current ||
+          parseInt(data.read_by_id) !== parseInt(selectedUserId)) {
+        return
+      }
+      setMessages(prev => prev.map(msg =>
+        msg.isSent && parseInt(msg.id) <= parseInt(data.message_id)
+          ? { ...msg, is_read: true }
+          : msg
+      ))
+      forceUpdate()
+    }
+
     // Clean up existing listeners
     ChatWebService.off('chat_message', handleChatMessage)
     ChatWebService.off('message_sent', handleMessageSent)
     ChatWebService.off('typing_indicator', handleTypingIndicator)
     ChatWebService.off('read_receipt', handleReadReceipt)
+    ChatWebService.off('read_up_to', handleReadUpTo)
 
     // Add new listeners
     ChatWebService.on('chat_message', handleChatMessage)
     ChatWebService.on('message_sent', handleMessageSent)
     ChatWebService.on('typing_indicator', handleTypingIndicator)
     ChatWebService.on('read_receipt', handleReadReceipt)
+    ChatWebService.on('read_up_to', handleReadUpTo)
 
     return () => {
       console.log('🧹 Cleaning up WebSocket listeners')
@@ -174,6 +200,7 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
       ChatWebService.off('message_sent', handleMessageSent)
       ChatWebService.off('typing_indicator', handleTypingIndicator)
       ChatWebService.off('read_receipt', handleReadReceipt)
+      ChatWebService.off('read_up_to', handleReadUpTo)
     }
   }, [selectedUserId, transformMessage, forceUpdate])
 
@@ -189,10 +216,8 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
         )
 
         if (unreadMessages.length > 0) {
-          console.log(`📧 Sending read receipts for ${unreadMessages.length} unread messages`)
-          unreadMessages.forEach(msg => {
-            ChatWebService.sendReadReceipt(msg.id)
-          })
+          console.log(`📧 Sending read receipt for ${unreadMessages.length} unread messages`)
+          ChatWebService.sendReadUpTo(unreadMessages[unreadMessages.length - 1].id)
         }
       }
     }
@@ -203,6 +228,10 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
 
   // Auto-scroll on messages change
   useEffect(() => {
+    if (skipAutoScrollRef.current) {
+      skipAutoScrollRef.current = false
+      return
+    }
     if (messages.length > 0) {
       scrollToBottom()
     }
@@ -216,7 +245,10 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
 
       if (response.data && response.data.messages) {
         const transformedMessages = response.data.messages.map(transformMessage)
+        chatroomIdRef.current = parseInt(response.data.chatroom_id)
         setMessages(transformedMessages)
+        setBeforeCursor(response.data.before_cursor)
+        setHasMoreBefore(Boolean(response.data.has_more_before))
         console.log('📥 Loaded messages:', transformedMessages.length)
 
         // Send read receipts for unread messages
@@ -224,9 +256,9 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
           !msg.is_read && parseInt(msg.sender_id) === parseInt(selectedUserId)
         )
 
-        unreadMessages.forEach(msg => {
-          ChatWebService.sendReadReceipt(msg.id)
-        })
+        if (unreadMessages.length > 0) {
+          ChatWebService.sendReadUpTo(unreadMessages[unreadMessages.length - 1].id)
+        }
       }
 
       setSelectedUser(selectedUserInfo || {
@@ -242,6 +274,34 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
     }
   }
 
+  // Load the previous page of history when scrolled to the top
+  const fetchOlderMessages = async () => {
+    if (!hasMoreBefore || loadingOlder || !beforeCursor) return
+
+    try {
+      setLoadingOlder(true)
+      const response = await getConversationMessages(selectedUserId, { before: beforeCursor })
+
+      if (response.data && response.data.messages) {
+        const olderMessages = response.data.messages.map(transformMessage)
+        skipAutoScrollRef.current = true
+        setMessages(prev => [...olderMessages, ...prev])
+        setBeforeCursor(response.data.before_cursor)
+        setHasMoreBefore(Boolean(response.data.has_more_before))
+      }
+    } catch (error) {
+      console.error("❌ Error fetching older messages:", error)
+    } finally {
+      setLoadingOlder(false)
+    }
+  }
+
+  const handleMessagesScroll = (e) => {
+    if (e.target.scrollTop === 0) {
+      fetchOlderMessages()
+    }
+  }
+
   const handleSendMessage = async () => {
     if (!message.trim() || !selectedUserId) return
 
@@ -347,7 +407,10 @@ export function ChatArea({ selectedUserId, selectedUserInfo = null }) {
       </div>
 
       {/* Messages */}
-      <div className="flex-1 overflow-y-auto p-4 space-y-4">
+      <div className="flex-1 overflow-y-auto p-4 space-y-4" onScroll={handleMessagesScroll}>
+        {loadingOlder && (
+          <div className="text-center text-xs text-gray-500">Loading older messages...</div>
+        )}
         {messages.length === 0 ? (
           <div className="text-center text-gray-500 mt-8">
             No messages yet. Start the conversation!
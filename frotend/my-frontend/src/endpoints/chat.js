@@ -8,12 +8,14 @@ export const refreshToken = () => chatAxios.post("refresh/");
 export const getConversation = (userId) => {
     return chatAxios.get(`conversation/${userId}/`);
 };
-export const users=()=>chatAxios.get('users/')
+// params: { search, after, limit } - after is the next_cursor of the previous page
+export const users=(params = {})=>chatAxios.get('users/', { params })
 
 export const conversation=()=>chatAxios.get("conversations/")
 
-export const getConversationMessages = (userId) => 
-  chatAxios.get(`conversation/${userId}/`)
+// params: { limit, before, after } - cursors come from the previous page
+export const getConversationMessages = (userId, params = {}) => 
+  chatAxios.get(`conversation/${userId}/`, { params })
 
 export const logout = async () => {
     try {
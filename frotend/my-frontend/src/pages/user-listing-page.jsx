@@ -10,14 +10,18 @@ export default function UserListingPage() {
   const [usersList, setUsersList] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
   const onlineCount = usersList.filter(user => user.status?.is_online).length;
   const totalCount = usersList.length;
 
+  // Username or email prefix search runs on the server, debounced
   useEffect(() => {
-    loadUsers();
-  }, []);
+    const timer = setTimeout(() => loadUsers(searchTerm.trim()), searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
   const handleLogout = async () => {
     try {
@@ -30,11 +34,12 @@ export default function UserListingPage() {
     }
   };
 
-  const loadUsers = async () => {
+  const loadUsers = async (search = '') => {
     setLoading(true);
     try {
-      const response = await usersAPI();
+      const response = await usersAPI(search ? { search } : {});
       setUsersList(response.data.data);
+      setNextCursor(response.data.next_cursor);
       setError('');
     } catch (err) {
       setError('Failed to load users. Please try again.');
@@ -44,6 +49,21 @@ export default function UserListingPage() {
     }
   };
 
+  const loadMoreUsers = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const search = searchTerm.trim();
+      const response = await usersAPI(search ? { search, after: nextCursor } : { after: nextCursor });
+      setUsersList(prev => [...prev, ...response.data.data]);
+      setNextCursor(response.data.next_cursor);
+    } catch (err) {
+      console.error('Error loading more users:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const filteredUsers = usersList.filter(user =>
     user.username?.toLowerCase().includes(searchTerm.toLowerCase()) ||
     user.email?.toLowerCase().includes(searchTerm.toLowerCase())
@@ -212,6 +232,17 @@ export default function UserListingPage() {
               ))}
             </div>
           )}
+          {!loading && nextCursor && (
+            <div className="p-4 text-center border-t border-gray-100">
+              <button
+                onClick={loadMoreUsers}
+                disabled={loadingMore}
+                className="px-6 py-2 text-sm font-medium text-blue-600 hover:text-blue-800 disabled:text-gray-400"
+              >
+                {loadingMore ? 'Loading...' : 'Load more users'}
+              </button>
+            </div>
+          )}
         </div>
 
         {/* Selected User Notification */}
@@ -8,6 +8,31 @@ class ChatWebService {
         this.reconnectAttempts = 0;
         this.reconnectTime = null;
         this.maxReconnectAttempt = 5;
+        // Newest message id seen by this user; sent as after_id to catch up after a reconnect
+        this.userId = null;
+        this.lastMessageId = 0;
+        // Newest seq seen per room id; the server resumes each room from these
+        this.roomCursors = {};
+    }
+
+    trackMessageId(messageId) {
+        const id = parseInt(messageId);
+        if (id > this.lastMessageId) {
+            this.lastMessageId = id;
+            localStorage.setItem(`lastMessageId:${this.userId}`, String(id));
+        }
+    }
+
+    trackCursor(chatroomId, seq) {
+        if (!chatroomId || !(seq > (this.roomCursors[chatroomId] || 0))) return;
+        this.roomCursors[chatroomId] = seq;
+        localStorage.setItem(`roomCursors:${this.userId}`, JSON.stringify(this.roomCursors));
+    }
+
+    trackMessage(message) {
+        if (!message) return;
+        this.trackMessageId(message.id);
+        this.trackCursor(message.chatroom_id, message.seq);
     }
 
     async connect() {
@@ -101,6 +126,7 @@ class ChatWebService {
 
         switch (type) {
             case 'chat_message':
+                this.trackMessage(data.message);
                 this.triggerHandler('chat_message', {
                     message: data.message,
                     sender_id: data.sender_id,
@@ -109,6 +135,7 @@ class ChatWebService {
                 break;
             
             case 'message_sent':
+                this.trackMessage(data.message);
                 this.triggerHandler('message_sent', {
                     message: data.message
                 });
@@ -118,6 +145,7 @@ class ChatWebService {
                 this.triggerHandler('typing_indicator', {
                     sender_id: data.sender_id,
                     sender_username: data.sender_username,
+                    chatroom_id: data.chatroom_id,
                     is_typing: data.is_typing
                 });
                 break;
@@ -130,11 +158,74 @@ class ChatWebService {
                 });
                 break;
             
+            case 'read_up_to':
+                this.triggerHandler('read_up_to', {
+                    chatroom_id: data.chatroom_id,
+                    message_id: data.message_id,
+                    count: data.count,
+                    read_by_id: data.read_by_id,
+                    read_by_username: data.read_by_username
+                });
+                break;
+            
             case 'connection':
+                if (this.userId !== data.user_id) {
+                    this.userId = data.user_id;
+                    this.lastMessageId = parseInt(localStorage.getItem(`lastMessageId:${data.user_id}`)) || 0;
+                    this.roomCursors = JSON.parse(localStorage.getItem(`roomCursors:${data.user_id}`) || '{}');
+                }
                 this.triggerHandler('connection', {
                     status: data.status,
                     user_id: data.user_id
                 });
+                // Fetch whatever arrived while we were away
+                if (this.lastMessageId) {
+                    this.send({ type: 'sync', cursors: this.roomCursors, after_id: this.lastMessageId });
+                }
+                break;
+            
+            case 'sync_batch':
+                // Replayed through the live handlers, which skip ids they already have
+                data.messages.forEach(message => {
+                    // Group messages have no receiver_id
+                    if (parseInt(message.sender_id) !== parseInt(this.userId)) {
+                        this.triggerHandler('chat_message', {
+                            message,
+                            sender_id: message.sender_id,
+                            sender_username: message.sender_username
+                        });
+                    } else {
+                        this.triggerHandler('message_sent', { message });
+                    }
+                    this.trackMessage(message);
+                });
+                break;
+            
+            case 'room_joined':
+            case 'room_left':
+                this.triggerHandler(type, {
+                    chatroom_id: data.chatroom_id,
+                    name: data.name
+                });
+                break;
+            
+            case 'resume':
+                // Sent just before the server closes a socket that fell too far
+                // behind (code 4008) with the newest seq that reached us in each
+                // room; the reconnect below syncs the rest from those cursors.
+                // after_id is not a high-water mark: ids commit out of order
+                // across rooms, so it only stands in for rooms without a cursor
+                Object.entries(data.cursors || {}).forEach(([chatroomId, seq]) => this.trackCursor(chatroomId, seq));
+                this.triggerHandler('resume', data);
+                break;
+            
+            case 'sync_complete':
+                this.trackMessageId(data.last_id);
+                Object.entries(data.cursors || {}).forEach(([chatroomId, seq]) => this.trackCursor(chatroomId, seq));
+                if (data.truncated) {
+                    // Too much missed to replay; views should reload from the API
+                    this.triggerHandler('resync_required', data);
+                }
                 break;
             
             case 'error':
@@ -201,6 +292,34 @@ class ChatWebService {
         return this.send(messageData);
     }
 
+    sendGroupMessage(chatroomId, content, messageType = 'text') {
+        if (!this.Connected) {
+            console.error('❌ Cannot send message: WebSocket not connected');
+            this.triggerHandler('error', {
+                error: 'Connection lost. Please wait while we reconnect...',
+                type: 'connection_error'
+            });
+            return false;
+        }
+
+        return this.send({
+            type: 'chat_message',
+            chatroom_id: chatroomId,
+            content: content,
+            message_type: messageType
+        });
+    }
+
+    sendGroupTypingIndicator(chatroomId, isTyping) {
+        if (!this.Connected) return false;
+
+        return this.send({
+            type: 'typing',
+            chatroom_id: chatroomId,
+            is_typing: isTyping
+        });
+    }
+
     sendTypingIndicator(receiverId, isTyping) {
         if (!this.Connected) return false;
 
@@ -246,6 +365,19 @@ class ChatWebService {
         return this.send(readReceiptData);
     }
 
+    // Marks every received message in the room up to messageId as read
+    sendReadUpTo(messageId) {
+        if (!this.Connected) {
+            console.error('❌ Cannot send read receipt: WebSocket not connected');
+            return false;
+        }
+
+        return this.send({
+            type: 'read_up_to',
+            message_id: messageId
+        });
+    }
+
     send(data) {
         if (this.socket && this.socket.readyState === WebSocket.OPEN) {
             try {